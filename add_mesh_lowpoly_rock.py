@@ -23,7 +23,7 @@ bl_info = {
     "name": "LowPoly Rock",
     "author": "Hidesato Ikeya",
     "version": (0, 1, 9),
-    "blender": (2, 68, 0),
+    "blender": (2, 70, 0),
     "location": "VIEW3D > ADD > Mesh",
     "description": "LowPoly Rock",
     "warning": "",
@@ -33,8 +33,8 @@ bl_info = {
 
 import bpy
 import bmesh
-from mathutils import Matrix
-from math import radians
+import numpy as np
+from math import radians, sqrt, ceil
 from random import seed, uniform
 
 ROCK_NAME = "LowPolyRock"
@@ -43,15 +43,27 @@ TEXTURE_NAME = ROCK_NAME + "Texture"
 ANGLE_MAX = radians(90)
 
 
-def get_basemesh(context, subdiv=5, radius=1.0, ratio=(1., 1., 1.)):
+def get_icosphere(context, subdiv=5):
+    """Unit icosphere mesh, its vertex coordinates as an (n, 3) array
+    and its triangles as an (m, 3) array"""
     me = context.blend_data.meshes.new('tempmeshname')
     bm = bmesh.new()
-    bm.from_mesh(me)
-    mat = Matrix()
-    mat[0][0], mat[1][1], mat[2][2] = ratio
-    bmesh.ops.create_icosphere(
-        bm, subdivisions=subdiv, diameter=radius, matrix=mat)
+    bmesh.ops.create_icosphere(bm, subdivisions=subdiv, diameter=1.0)
     bm.to_mesh(me)
+    bm.free()
+    coords = np.empty(len(me.vertices) * 3, dtype=np.float32)
+    me.vertices.foreach_get('co', coords)
+    faces = np.empty(len(me.loops), dtype=np.int32)
+    me.loops.foreach_get('vertex_index', faces)
+    return me, coords.reshape(-1, 3), faces.reshape(-1, 3)
+
+def get_basemesh(context, icosphere, radius=1.0, ratio=(1., 1., 1.)):
+    """Copy of a get_icosphere mesh scaled by radius and ratio"""
+    sphere, coords = icosphere[:2]
+    me = sphere.copy()
+    me.vertices.foreach_set(
+        'co', (coords * (np.array(ratio, dtype=np.float32) * radius)).ravel())
+    me.update()
     return me
 
 def get_texture(context, name, size=1.0, brightness=.8, contrast=.8,
@@ -69,20 +81,271 @@ def get_texture(context, name, size=1.0, brightness=.8, contrast=.8,
     ramp.elements[0].position = .5
     return tex
 
-def create_rock(context, subdiv, radius, size_ratio,
+def hash_cells(cells):
+    """Three pseudo random numbers in [0, 1) per integer cell of an (n, 3) array"""
+    h = (cells.astype(np.uint64) * np.array(
+        [0x9E3779B1, 0x85EBCA77, 0xC2B2AE3D], dtype=np.uint64)).sum(axis=1)
+    rand = np.empty(cells.shape)
+    for i in range(3):
+        h = (h + np.uint64(0x9E3779B97F4A7C15)) * np.uint64(0xBF58476D1CE4E5B9)
+        h ^= h >> np.uint64(31)
+        rand[:, i] = (h >> np.uint64(11)) * 2.0 ** -53
+    return rand
+
+def voronoi_distances(points):
+    """Distances of (n, 3) points to their three nearest feature points,
+    one feature point jittered into every unit cell"""
+    cell = np.floor(points).astype(np.int64)
+    dist = np.empty((len(points), 27))
+    offsets = np.indices((3, 3, 3)).reshape(3, -1).T - 1
+    for i, offset in enumerate(offsets):
+        neighbour = cell + offset
+        feature = neighbour + hash_cells(neighbour)
+        dist[:, i] = np.sqrt(((points - feature) ** 2).sum(axis=1))
+    return np.sort(np.partition(dist, 2, axis=1)[:, :3], axis=1)
+
+def voronoi_texture(points, brightness=.8, contrast=.8, weights=(1.0, .3, .0)):
+    """Values of the get_texture Voronoi texture at (n, 3) points
+    in texture space"""
+    value = np.abs(voronoi_distances(points).dot(weights))
+    value = (value - .5) * contrast + brightness - .5
+    # Color ramp, black up to .5 and a smooth rise to white at 1.0
+    t = np.clip((value - .5) * 2.0, .0, 1.0)
+    return t * t * (3.0 - 2.0 * t)
+
+def vertex_normals(coords, faces):
+    """Area weighted vertex normals of a triangle mesh"""
+    tri = coords[faces]
+    face_normals = np.cross(tri[:, 1] - tri[:, 0], tri[:, 2] - tri[:, 0])
+    normals = np.zeros(coords.shape)
+    for i in range(3):
+        for axis in range(3):
+            normals[:, axis] += np.bincount(
+                faces[:, i], face_normals[:, axis], len(coords))
+    length = np.sqrt((normals ** 2).sum(axis=1))
+    return normals / np.maximum(length, 1e-12)[:, None]
+
+def face_quadrics(coords, faces):
+    """Error quadrics of the face planes, summed per vertex as (n, 4, 4)"""
+    tri = coords[faces]
+    normals = np.cross(tri[:, 1] - tri[:, 0], tri[:, 2] - tri[:, 0])
+    normals /= np.maximum(
+        np.sqrt((normals ** 2).sum(axis=1)), 1e-12)[:, None]
+    planes = np.concatenate(
+        (normals, -(normals * tri[:, 0]).sum(axis=1)[:, None]), axis=1)
+    products = (planes[:, :, None] * planes[:, None, :]).reshape(-1, 16)
+    quadrics = np.zeros((len(coords), 16))
+    for corner in range(3):
+        for i in range(16):
+            quadrics[:, i] += np.bincount(
+                faces[:, corner], products[:, i], len(coords))
+    return quadrics.reshape(-1, 4, 4)
+
+def collapse_edges(coords, faces, ratio):
+    """Collapse a closed triangle mesh to about ratio of its faces with
+    quadric error edge collapses, keeping it a closed manifold.
+    Every round collapses edges that are the cheapest within two rings of
+    their vertices, so the collapses of a round touch separate faces.
+    Collapses that break the link condition or flip a face are skipped."""
+    coords = coords.astype(np.float64)
+    faces = faces.astype(np.int64)
+    nverts = len(coords)
+    target = max(4, int(len(faces) * ratio))
+    quadrics = face_quadrics(coords, faces)
+    blocked = np.zeros(0, dtype=np.int64)
+
+    while len(faces) > target:
+        # Edges and the neighbours of every vertex
+        edges = np.sort(faces[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2), axis=1)
+        keys = np.unique(edges[:, 0] * nverts + edges[:, 1])
+        u, v = keys // nverts, keys % nverts
+        src = np.concatenate((u, v))
+        dst = np.concatenate((v, u))
+        order = np.argsort(src, kind='mergesort')
+        src, dst = src[order], dst[order]
+        degree = np.bincount(src, minlength=nverts)
+        first = np.zeros(nverts + 1, dtype=np.int64)
+        np.cumsum(degree, out=first[1:])
+
+        # Link condition, u and v share exactly the two opposite vertices
+        edge = np.repeat(np.arange(len(keys)), degree[u])
+        local = np.arange(len(edge)) \
+            - np.repeat(np.cumsum(degree[u]) - degree[u], degree[u])
+        w = dst[first[u][edge] + local]
+        other = v[edge]
+        shared = np.isin(np.minimum(other, w) * nverts + np.maximum(other, w),
+                         keys)
+        valid = np.bincount(edge, shared, len(keys)) == 2
+        valid &= ~np.isin(keys, blocked)
+
+        # Cost of moving both vertices to the point of least error, or to u,
+        # v or their midpoint where that point is ill defined
+        quadric = quadrics[u] + quadrics[v]
+        midpoint = (coords[u] + coords[v]) / 2.0
+        length = ((coords[u] - coords[v]) ** 2).sum(axis=1)
+        rows = quadric[:, :3, :3]
+        adjugate = np.stack((np.cross(rows[:, 1], rows[:, 2]),
+                             np.cross(rows[:, 2], rows[:, 0]),
+                             np.cross(rows[:, 0], rows[:, 1])), axis=1)
+        det = (rows[:, 0] * adjugate[:, 0]).sum(axis=1)
+        trace = rows[:, 0, 0] + rows[:, 1, 1] + rows[:, 2, 2]
+        solvable = np.abs(det) > 1e-6 * trace ** 3
+        optimum = -(adjugate * quadric[:, :3, 3:]).sum(axis=1) \
+            / np.where(solvable, det, 1.0)[:, None]
+        solvable &= ((optimum - midpoint) ** 2).sum(axis=1) < length * 4.0
+        optimum[~solvable] = midpoint[~solvable]
+        candidates = np.stack(
+            (optimum, coords[u], coords[v], midpoint), axis=1)
+        points = np.concatenate(
+            (candidates, np.ones(candidates.shape[:2] + (1,))), axis=2)
+        errors = (np.matmul(points, quadric) * points).sum(axis=2)
+        best = errors.argmin(axis=1)
+        position = candidates[np.arange(len(keys)), best]
+        cost = np.maximum(errors[np.arange(len(keys)), best], .0) \
+            + length * 1e-3
+        cost[~valid] = np.inf
+        if not np.isfinite(cost).any():
+            break
+
+        # Edges cheapest within two rings of their vertices, then again among
+        # the edges clear of the rings of those already chosen
+        rank = np.empty(len(keys), dtype=np.int64)
+        rank[np.argsort(cost, kind='mergesort')] = np.arange(len(keys))
+        eligible = np.isfinite(cost)
+        chosen = []
+        for sweep in range(4):
+            eligible_rank = np.where(eligible, rank, len(keys))
+            ring = np.full(nverts, len(keys), dtype=np.int64)
+            np.minimum.at(ring, u, eligible_rank)
+            np.minimum.at(ring, v, eligible_rank)
+            rings = ring.copy()
+            np.minimum.at(rings, src, ring[dst])
+            picked = np.flatnonzero(eligible & (
+                eligible_rank == np.minimum(rings[u], rings[v])))
+            if not len(picked):
+                break
+            chosen.append(picked)
+            locked = np.zeros(nverts, dtype=bool)
+            locked[u[picked]] = True
+            locked[v[picked]] = True
+            locked[dst[locked[src]]] = True
+            eligible &= ~(locked[u] | locked[v])
+        chosen = np.concatenate(chosen)
+        chosen = chosen[np.argsort(cost[chosen], kind='mergesort')]
+        chosen = chosen[:max(1, (len(faces) - target + 1) // 2)]
+
+        # Skip collapses that flip a remaining face
+        owner = np.full(nverts, -1, dtype=np.int64)
+        owner[u[chosen]] = chosen
+        owner[v[chosen]] = chosen
+        face_owner = owner[faces].max(axis=1)
+        moved = np.flatnonzero(face_owner >= 0)
+        k = face_owner[moved]
+        tri = faces[moved]
+        ends = (tri == u[k][:, None]) | (tri == v[k][:, None])
+        keep = ends.sum(axis=1) == 1
+        moved, k, tri, ends = moved[keep], k[keep], tri[keep], ends[keep]
+        before = coords[tri]
+        after = before.copy()
+        after[ends] = position[k]
+        normal_before = np.cross(before[:, 1] - before[:, 0],
+                                 before[:, 2] - before[:, 0])
+        normal_after = np.cross(after[:, 1] - after[:, 0],
+                                after[:, 2] - after[:, 0])
+        cos = (normal_before * normal_after).sum(axis=1) / np.maximum(
+            np.sqrt((normal_before ** 2).sum(axis=1)
+                    * (normal_after ** 2).sum(axis=1)), 1e-30)
+        flipped = np.unique(k[cos < .2])
+        blocked = np.concatenate((blocked, keys[flipped]))
+        chosen = np.setdiff1d(chosen, flipped)
+        if not len(chosen):
+            continue
+
+        # Collapse v onto u
+        cu, cv = u[chosen], v[chosen]
+        coords[cu] = position[chosen]
+        quadrics[cu] += quadrics[cv]
+        remap = np.arange(nverts)
+        remap[cv] = cu
+        faces = remap[faces]
+        faces = faces[(faces[:, 0] != faces[:, 1])
+                      & (faces[:, 1] != faces[:, 2])
+                      & (faces[:, 2] != faces[:, 0])]
+
+    # Drop collapsed vertices
+    used, faces = np.unique(faces, return_inverse=True)
+    return coords[used], faces.reshape(-1, 3)
+
+def write_mesh(me, coords, faces):
+    """Fill an empty mesh with an (n, 3) coordinate and (m, 3) triangle array"""
+    me.vertices.add(len(coords))
+    me.vertices.foreach_set('co', coords.astype(np.float32).ravel())
+    me.loops.add(faces.size)
+    me.loops.foreach_set('vertex_index', faces.astype(np.int32).ravel())
+    me.polygons.add(len(faces))
+    me.polygons.foreach_set(
+        'loop_start', np.arange(0, faces.size, 3, dtype=np.int32))
+    me.polygons.foreach_set(
+        'loop_total', np.full(len(faces), 3, dtype=np.int32))
+    me.update(calc_edges=True)
+    return me
+
+def dissolve_planar(me, angle_limit):
+    bm = bmesh.new()
+    bm.from_mesh(me)
+    bmesh.ops.dissolve_limit(
+        bm, angle_limit=angle_limit, use_dissolve_boundaries=True,
+        verts=bm.verts[:], edges=bm.edges[:])
+    bm.to_mesh(me)
+    bm.free()
+
+def create_rock_mesh(context, icosphere, radius, size_ratio,
+                     noise_center, noise_size, noise_brightness,
+                     sharpness, displace_midlevel, displace_strength,
+                     voronoi_weights, simplicity, collapse_ratio):
+    """The rock create_rock makes with its modifiers applied, computed on
+    vertex and face arrays without modifiers or scene updates"""
+    coords, faces = icosphere[1:]
+    coords = coords * (np.array(size_ratio) * radius)
+
+    # Displacement
+    origin = np.array(noise_center) * radius
+    texture = voronoi_texture(
+        (coords - origin) / max(radius * noise_size, 1e-9),
+        brightness=noise_brightness, contrast=sharpness,
+        weights=voronoi_weights)
+    offset = (texture - displace_midlevel) * (radius * displace_strength)
+    coords = coords + vertex_normals(coords, faces) * offset[:, None]
+
+    # Collapse
+    if collapse_ratio < 1.0:
+        coords, faces = collapse_edges(coords, faces, collapse_ratio)
+
+    me = write_mesh(context.blend_data.meshes.new(ROCK_NAME), coords, faces)
+
+    # Planer
+    if simplicity > .0:
+        dissolve_planar(me, simplicity * ANGLE_MAX)
+    return me
+
+def add_rock(context, me):
+    rock = context.blend_data.objects.new(ROCK_NAME, me)
+    rock.show_all_edges = True
+    context.scene.objects.link(rock)
+    context.scene.objects.active = rock
+    return rock
+
+def create_rock(context, icosphere, radius, size_ratio,
                 noise_center, noise_size, noise_brightness,
                 sharpness, displace_midlevel, displace_strength,
                 voronoi_weights, simplicity, collapse_ratio):
-    me = get_basemesh(context, subdiv, radius, size_ratio)
-    rock = context.blend_data.objects.new(ROCK_NAME, me)
-    rock.show_all_edges = True
+    me = get_basemesh(context, icosphere, radius, size_ratio)
+    rock = add_rock(context, me)
     ix_dot = rock.name.rfind('.')
     if ix_dot != -1:
         number = rock.name[ix_dot:]
     else:
         number = ""
-    context.scene.objects.link(rock)
-    context.scene.objects.active = rock
 
     # Displacement
     noise_origin = \
@@ -122,7 +385,7 @@ class LowPolyRock(bpy.types.Operator):
     bl_options = {'REGISTER', 'UNDO', 'PRESET'}
 
     num_rock = bpy.props.IntProperty(
-        name="Number", min=1, max=9, default=1,
+        name="Number", min=1, max=10000, soft_max=100, default=1,
         description="Number of rocks")
     size = bpy.props.FloatProperty(
         name="Size", min=.0, default=1.0, precision=3, step=0.01)
@@ -160,6 +423,10 @@ class LowPolyRock(bpy.types.Operator):
     keep_modifiers = bpy.props.BoolProperty(
         name="Keep Modifiers", default=False,
         description="Keep modifiers")
+    array_mesh = bpy.props.BoolProperty(
+        name="Array Mesh", default=False,
+        description="Build the final rock mesh from vertex and face arrays "
+                    "instead of applying the modifiers (slower)")
     advanced_menu = bpy.props.BoolProperty(
         name="Advanced Menu", default=False,
         description="Display advanced menu")
@@ -226,6 +493,8 @@ class LowPolyRock(bpy.types.Operator):
         advanced.prop(self, 'advanced_menu', text="Advanced Settings:")
         if self.advanced_menu:
             advanced.prop(self, 'keep_modifiers')
+            if not self.keep_modifiers:
+                advanced.prop(self, 'array_mesh')
             advanced.prop(self, 'displace_strength')
             advanced.prop(self, 'voronoi_weights')
             advanced.prop(self, 'noise_size')
@@ -245,39 +514,55 @@ class LowPolyRock(bpy.types.Operator):
             random_seed = None
         seed(random_seed)
 
-        location = context.scene.cursor_location.copy()
+        # The icosphere is built once, every rock starts from scaled copies
+        # of its mesh or its arrays
+        icosphere = get_icosphere(context, self.subdiv)
+
+        # Rocks are laid out in a grid of about sqrt(num_rock) columns,
+        # centered on the cursor
+        cursor = context.scene.cursor_location.copy()
+        columns = int(ceil(sqrt(self.num_rock)))
+        rows = (self.num_rock + columns - 1) // columns
+        spacing = self.size * 1.6
+
         rocks = [None] * self.num_rock
         for n in range(self.num_rock):
-            rock, noise_origin = create_rock(
-                context, self.subdiv, radius, size_ratio,
+            location = cursor.copy()
+            location.x += spacing * (n % columns - (columns - 1) / 2.0)
+            location.y += spacing * ((rows - 1) / 2.0 - n // columns)
+
+            settings = (
+                context, icosphere, radius, size_ratio,
                 noise_center, self.noise_size, self.noise_brightness,
                 self.sharpness, self.displace_midlevel, self.displace_strength,
                 self.voronoi_weights, self.simplicity, self.collapse_ratio)
-            rocks[n] = rock
 
-            if self.keep_modifiers:
-                rock.location = location
-                noise_origin.location += location
+            if self.array_mesh and not self.keep_modifiers:
+                rock = add_rock(context, create_rock_mesh(*settings))
             else:
-                context.scene.update()
-                me_orig = rock.data
-                tex = rock.modifiers['displace'].texture
-                rock.data = rock.to_mesh(context.scene, True, 'PREVIEW')
-                context.blend_data.meshes.remove(me_orig)
-                rock.modifiers.clear()
-                rock.location = location
-                context.scene.objects.unlink(noise_origin)
-                context.blend_data.objects.remove(noise_origin)
-                context.blend_data.textures.remove(tex)
+                rock, noise_origin = create_rock(*settings)
+                if self.keep_modifiers:
+                    noise_origin.location += location
+                else:
+                    context.scene.update()
+                    me_orig = rock.data
+                    tex = rock.modifiers['displace'].texture
+                    rock.data = rock.to_mesh(context.scene, True, 'PREVIEW')
+                    context.blend_data.meshes.remove(me_orig)
+                    rock.modifiers.clear()
+                    context.scene.objects.unlink(noise_origin)
+                    context.blend_data.objects.remove(noise_origin)
+                    context.blend_data.textures.remove(tex)
+            rock.location = location
+            rocks[n] = rock
 
             if self.edge_split:
-                rock.select = True
-                bpy.ops.object.shade_smooth()
+                rock.data.polygons.foreach_set(
+                    'use_smooth', [True] * len(rock.data.polygons))
                 split = rock.modifiers.new('split', 'EDGE_SPLIT')
                 split.use_edge_angle = True
                 split.use_edge_sharp = False
                 split.split_angle = .0
-                rock.select = False
 
             rock.data.name = rock.name
 
@@ -286,13 +571,8 @@ class LowPolyRock(bpy.types.Operator):
                 noise_center[i] = self.noise_center[i] + uniform(-1000, 1000)
                 size_ratio[i] = self.size_ratio[i] * \
                     (1.0 + uniform(self.size_ratio_min[i], self.size_ratio_max[i]))
-            if n % 2 == 0:
-                location.x = context.scene.cursor_location.x \
-                    + self.size * 1.6 * (n // 2 + 1)
-            else:
-                location.x = context.scene.cursor_location.x \
-                    - self.size * 1.6 * (n // 2 + 1)
 
+        context.blend_data.meshes.remove(icosphere[0])
         for rock in rocks:
             rock.select = True
 
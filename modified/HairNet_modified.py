@@ -5,14 +5,17 @@
 # Some routines were copied from other sources
 # Very limited at this time:
 # NB 1) After running the script to create hair, the user MUST manually enter Particle Mode on the Head object and "touch" each point of each hair guide. Using a large comb brish with very low strength is a good way to do this. If it's not done, the hair strands are likely to be reset to a default/straight-out position during editing.
-# NB 2) All meshes must have the same number of vertices in the direction that corresponds to hair growth
+# NB 2) Guides with different numbers of vertices in the direction of hair growth are resampled by arc length to a common number of points (Guide Steps)
+# NB 3) Any number of hair objects can be selected, with the head object selected last (active). Each gets its own particle system on the head object.
+# NB 4) Sheets can get extra guides interpolated between neighbouring guides along the seam (Interpolated Guides), linearly between pairs or barycentric between three.
+# NB 5) Messages go to the "HairNet_modified" logger, silent by default (enableLogging() shows them). Phase timings of the last run are kept, see getTimings() and getTimingTotals().
 #---------------------------------------------------
 
 bl_info = {
         "name":"HairNet",
         "author": "Rhett Jackson",
         "version": (0,4,5),
-        "blender": (2,6,7),
+        "blender": (2,7,0),
         "location": "Properties",
         "category": "Particle",
         "description": "Creates a particle hair system with hair guides from mesh edges which start at marked seams.",
@@ -21,75 +24,100 @@ bl_info = {
         }
 
 import bpy
+import time
+import hashlib
+import logging
+from contextlib import contextmanager
+import numpy as np
 from bpy.utils import register_module, unregister_module
-from bpy.props import StringProperty, BoolProperty
+from bpy.props import StringProperty, BoolProperty, IntProperty, EnumProperty
+
+#HairNet logs through the "HairNet_modified" logger, silent unless a handler
+#is set up, e.g. with enableLogging()
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+#Show the log messages of level and above on the console
+def enableLogging(level=logging.DEBUG):
+    if not any(isinstance(h, logging.StreamHandler) for h in log.handlers):
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("HairNet %(levelname)s: %(message)s"))
+        log.addHandler(handler)
+    log.setLevel(level)
+
+#Timing spans of the last run as (phase, name, seconds), phases are
+#"mesh eval", "seam scan", "loop walk", "guide build" and "hair write"
+_timings = []
+
+#Record the time spent in the with block as a span of phase
+@contextmanager
+def timeSpan(phase, name=""):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        _timings.append((phase, name, seconds))
+        log.debug("%s %s: %.4f s", phase, name or "-", seconds)
+
+#Timing spans of the last run, all of them or those of one phase
+def getTimings(phase=None):
+    return [span for span in _timings if phase is None or span[0] == phase]
+
+#Total seconds per phase of the last run
+def getTimingTotals():
+    totals = {}
+    for phase, name, seconds in _timings:
+        totals[phase] = totals.get(phase, 0.0) + seconds
+    return totals
 
-def debPrintVertEdges(vert_edges):
-    print("vert_edges: ")
-    for vert in vert_edges:
-        print(vert, ": ", vert_edges[vert])
-        
-def debPrintEdgeFaces(edge_faces):
-    print("edge_faces: ")
-    for edge in edge_faces:
-        print(edge, ": ", edge_faces[edge])
-        
-def debPrintHairGuides(hairGuides):
-    print("Hair Guides:")
-    guideN=0
-    
-    for group in hairGuides:
-        print("Guide #",guideN)
-        i=0
-        for guide in group:
-            print(i, " : ", guide)
-            i += 1
-        guideN+=1
-        
 def debPrintSeams(seamVerts, seamEdges):
-    print("Verts in the seam: ")
-    for vert in seamVerts:
-        print(vert)
-    print("Edges in the seam: ")
-    for edge in seamEdges:
-        print(edge.index)
+    if not log.isEnabledFor(logging.DEBUG):
+        return
+    log.debug("Verts in the seam: %s", seamVerts)
+    log.debug("Edges in the seam: %s", seamEdges.tolist())
         
-def getEdgeFromKey(mesh,key):
-    v1 = key[0]
-    v2 = key[1]
-    theEdge = 0
-    for edge in mesh.edges:
-        if v1 in edge.vertices and v2 in edge.vertices:
-            #print("Found edge :", edge.index)
-            return edge
-    return 0
-
 def debPrintLoc(func=""):
+    if not log.isEnabledFor(logging.DEBUG):
+        return
     obj = bpy.context.object
-    print(obj.name, " ", func)
-    print("Coords", obj.data.vertices[0].co)
- 
-def createHair(ob, guides, options):
-    
-    tempActive = bpy.context.scene.objects.active
-    bpy.context.scene.objects.active = ob
-    
-    nGuides = len(guides)
-    print("nGguides", nGuides)
-    nSteps = len(guides[0])
-    print("nSteps", nSteps)
-    
-    # Create hair particle system if  needed
-    #bpy.ops.object.mode_set(mode='OBJECT')
-    #bpy.ops.object.particle_system_add()
-    psys = ob.particle_systems.active
-    #psys.name = 'HairNet System'
+    log.debug("%s %s", obj.name, func)
+    log.debug("Coords %s", obj.data.vertices[0].co)
  
+#Write the hair keys of all particles of a particle system.
+#coords holds nSteps key coordinates per particle, one particle after the other.
+#Every particle is written with one foreach_set per key property, the keys are
+#only set one at a time when the hair keys do not support foreach_set.
+def writeHairKeys(psys, coords, nSteps):
+    coords = np.ascontiguousarray(coords, dtype=np.float32).reshape(-1, nSteps * 3)
+    times = np.linspace(0.0, 100.0, nSteps).astype(np.float32)
+    weights = np.linspace(1.0, 0.0, nSteps).astype(np.float32)
+    bulk = True
+    for m in range(len(coords)):
+        part = psys.particles[m]
+        part.location = coords[m, :3]
+        if bulk:
+            try:
+                part.hair_keys.foreach_set("co", coords[m])
+                part.hair_keys.foreach_set("time", times)
+                part.hair_keys.foreach_set("weight", weights)
+                continue
+            except (AttributeError, TypeError, RuntimeError):
+                bulk = False
+        guide = coords[m].reshape(-1, 3)
+        for n, h in enumerate(part.hair_keys):
+            h.co = guide[n]
+            h.time = times[n]
+            h.weight = weights[n]
+    return bulk
+
+#Set up the particle settings of a hair system for nGuides guides of nSteps points
+def setHairSettings(psys, nGuides, nSteps, options):
     # Particle settings
     pset = psys.settings
     
     if options[0] != 0:
-        psys.settings = options[0]
+        psys.settings = pset = options[0]
     else:
         
         pset.type = 'HAIR'
@@ -110,40 +138,45 @@ def createHair(ob, guides, options):
         
     pset.hair_step = nSteps-1
     pset.count = nGuides
- 
-    # Disconnect hair and switch to particle edit mode
-    bpy.ops.particle.disconnect_hair(all=True)
-    bpy.ops.particle.particle_edit_toggle()
 
-    # Set all hair-keys
-    dt = 100.0/(nSteps-1)
-    dw = 1.0/(nSteps-1)  
+#Write the guides of one or more hair systems of ob, with a single
+#particle edit transition for all of them.
+#systems ... list of (psys, coords, offsets, options), coords and offsets
+#            are all guide coordinates and the offsets where each guide starts
+def createHair(ob, systems):
+    
+    tempActive = bpy.context.scene.objects.active
+    bpy.context.scene.objects.active = ob
+    tempIndex = ob.particle_systems.active_index
+    
+    for psys, coords, offsets, options in systems:
+        nGuides = len(offsets) - 1
+        nSteps = int(offsets[1] - offsets[0])
+        log.info("%s: %d guides of %d steps", psys.name, nGuides, nSteps)
+        setHairSettings(psys, nGuides, nSteps, options)
+        
+        # The particle operators work on the active system
+        ob.particle_systems.active_index = ob.particle_systems.find(psys.name)
+ 
+        # Disconnect hair and switch to particle edit mode
+        bpy.ops.particle.disconnect_hair(all=False)
+        bpy.ops.particle.particle_edit_toggle()
 
-    # Connect hair to mesh
-    # Segmentation violation during render if this line is absent.
-    #Connecting hair moves the mesh points by an amount equal to the object's location
-    bpy.ops.particle.connect_hair(all=True)
+        # Connect hair to mesh
+        # Segmentation violation during render if this line is absent.
+        #Connecting hair moves the mesh points by an amount equal to the object's location
+        bpy.ops.particle.connect_hair(all=False)
 
-    for m in range(nGuides):
-        #print("Working on guide #", m)
-        nSteps = len(guides[m])
-        guide = guides[m]
-        part = psys.particles[m]
+        # Set all hair-keys
         bpy.context.scene.tool_settings.particle_edit.use_preserve_root = False
-        part.location = guide[0]
-        #bpy.context.scene.tool_settings.particle_edit.use_preserve_root = True
         bpy.context.scene.tool_settings.particle_edit.use_preserve_length = False
-        for n in range(0, nSteps):
-            point = guide[n]
-            h = part.hair_keys[n]
-            #h.co_local = point
-            h.co = point
-            h.time = n*dt
-            h.weight = 1.0 - n*dw
-    
-    # Toggle particle edit mode
-    #bpy.ops.particle.select_all(action='SELECT')
-    bpy.ops.particle.particle_edit_toggle()
+        writeHairKeys(psys, coords, nSteps)
+        
+        # Toggle particle edit mode
+        #bpy.ops.particle.select_all(action='SELECT')
+        bpy.ops.particle.particle_edit_toggle()
+    
+    ob.particle_systems.active_index = tempIndex
 
     # Unfortunately, here a manual step appears to be needed:
     # 1. Toggle to particle mode
@@ -163,261 +196,510 @@ def createHair(ob, guides, options):
     bpy.context.scene.objects.active = tempActive
     return
 
-def sortLoop(vloop, v1, seamEdges, vert_edges):
+def sortLoop(vloop, v1):
     #The hair is either forward or reversed. If it's reversed, reverse it again. Otherwise do nothing.
-    loop = []
-    loopRange = len(vloop)-1
-    
-    if vloop[0] == v1.index:
-        loop = vloop.copy()
-        
-    else:
-        loop = vloop[::-1]
-    return loop
+    if vloop[0] == v1:
+        return vloop
+    return vloop[::-1]
 
-def getHairsFromFibers(hair):
-    me = hair.data
-    usedV = []
-    usedE = []
-    guides = []
-       
-    # Create a dictionary with the vert index as key and edge-keys as value
-    #It's a list of verts and the keys are the edges the verts belong to
-    vert_edges = dict([(v.index, []) for v in me.vertices if v.hide!=1])
-    for ed in me.edges:
-        for v in ed.key:
-            if ed.key[0] in vert_edges and ed.key[1] in vert_edges:
-                vert_edges[v].append(ed.key)
-    
-    #endPoints = dict([(v, []) for v in vert_edges if len(vert_edges[v])<2])
-    endPoints = [v for v in vert_edges if len(vert_edges[v])<2]
-    
-    #For every endpoint
-    for vert in endPoints:
-            hair=[]
-            print("first endpoint is ", vert)
-            #check if EP has been used already in case it was a tail end already
-            if vert not in usedV:
-                #lookup the endpoint in vert_edges to get the edge(s) it's in
-                thisEdge = getEdgeFromKey(me,vert_edges[vert][0])
-                print("Got edge ", thisEdge)
-                #Add the vert to the hair
-                hair.append(vert)
-                #mark the current vert as used
-                #mark the current edge as used
-                usedE.append(thisEdge)
-                usedV.append(vert)
-                #get the next/other vert in the edge
-                #make it the current vert
-                vert = getNextVertInEdge(thisEdge,vert)
-                print("got next vert ", vert, " edges", vert_edges[vert])
-                #while the number of edges the current vert is  > 1
-                while len(vert_edges[vert])>1:
-                    #lookup the endpoint in vert_edges to get the edge(s) it's in
-                    thisEdge = getEdgeFromKey(me,vert_edges[vert][0])
-                    
-                    if thisEdge in usedE:
-                        thisEdge = getEdgeFromKey(me,vert_edges[vert][1])
-                    #Add the vert to the hair
-                    hair.append(vert)
-                    #mark the current vert as used
-                    #mark the current edge as used
-                    usedE.append(thisEdge)
-                    usedV.append(vert)
-                    #get the next/other vert in the edge
-                    #make it the current vert
-                    vert = getNextVertInEdge(thisEdge,vert)
-                    print("vert #", vert)
-                    print("edge #", thisEdge)
-                    print(vert_edges[vert])
-                
-                
-                #Add the current vert to the hair
-                hair.append(vert)
-                #mark the current vert as used
-                usedV.append(vert)
-                #add the hair to the list of hairs
-                guides.append(hair)
-                
-    #guides now holds a list of hairs where each hair is a list of vertex indices in the mesh "me"
-    return guides
+#Incidence of items to groups, groups holds the group of every item.
+#The items of group g are order[first[g]:first[g + 1]], in item order.
+def getIncidence(groups, count):
+    order = np.argsort(groups, kind='mergesort')
+    first = np.zeros(count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(groups, minlength=count), out=first[1:])
+    return first, order
+
+#Read a property of all items of a collection into an array, (n, size) for vectors
+def readArray(collection, attr, size=1, dtype=np.float32):
+    data = np.empty(len(collection) * size, dtype=dtype)
+    collection.foreach_get(attr, data)
+    if size > 1:
+        return data.reshape(-1, size)
+    return data
+
+#Read the edges of a mesh as an (n, 2) array of vertex indices, leaving out
+#edges with a hidden vertex
+def getEdgeArray(me):
+    edges = readArray(me.edges, "vertices", 2, np.int32)
+    hidden = readArray(me.vertices, "hide", 1, bool)
+    return edges[~(hidden[edges[:, 0]] | hidden[edges[:, 1]])]
+
+#Read the vertex coordinates of a mesh as an (n, 3) array
+def getCoordArray(me):
+    return readArray(me.vertices, "co", 3)
+
+#Read what fibre guides are made from, the vertex coordinates and visible edges
+def readFibers(me):
+    return dict(coords=getCoordArray(me), edges=getEdgeArray(me))
+
+#Read what sheet guides are made from, in bulk
+def readSheet(me):
+    return dict(coords=getCoordArray(me),
+                edges=readArray(me.edges, "vertices", 2, np.int32),
+                seam=readArray(me.edges, "use_seam", 1, bool),
+                hidden=readArray(me.vertices, "hide", 1, bool),
+                loopEdges=readArray(me.loops, "edge_index", 1, np.int32),
+                loopStarts=readArray(me.polygons, "loop_start", 1, np.int32),
+                loopTotals=readArray(me.polygons, "loop_total", 1, np.int32),
+                faceHidden=readArray(me.polygons, "hide", 1, bool))
+
+#Apply a 4x4 matrix to an (n, 3) coordinate array with one matrix multiply
+def transformCoords(matrix, coords):
+    matrix = np.array(matrix, dtype=np.float32)
+    return coords.dot(matrix[:3, :3].T) + matrix[:3, 3]
+
+#Split a mesh of fibres into chains of vertices running from an endpoint.
+#Vertex degrees and the adjacency are built once from the edge array, the
+#chains are walked with visited bitmaps, so every vertex and edge is visited once.
+#edges ... visible edges as returned by getEdgeArray
+#Returns the vertex indices of all hairs, one after the other, and the offsets
+#where each hair starts, with the total length as the last offset.
+def getHairsFromFibers(edges, nVerts):
+    ends = edges.ravel()
+    degree = np.bincount(ends, minlength=nVerts)
+
+    #adjacency: the neighbours and edges of vertex v are in
+    #neighbours[first[v]:first[v + 1]] and adjEdges[first[v]:first[v + 1]]
+    first, order = getIncidence(ends, len(degree))
+    neighbours = ends[order ^ 1].tolist()
+    adjEdges = (order >> 1).tolist()
+    first = first.tolist()
+    degree = degree.tolist()
+
+    usedV = bytearray(len(degree))
+    usedE = bytearray(len(edges))
+    hairs = []
+    offsets = [0]
+    #every chain starts at an endpoint, a vertex with a single edge
+    for vert in np.flatnonzero(np.asarray(degree) == 1).tolist():
+        if usedV[vert]:
+            #it was the tail end of a chain already
+            continue
+        while True:
+            hairs.append(vert)
+            usedV[vert] = 1
+            nextVert = -1
+            for k in range(first[vert], first[vert + 1]):
+                if not usedE[adjEdges[k]]:
+                    usedE[adjEdges[k]] = 1
+                    nextVert = neighbours[k]
+                    break
+            if nextVert < 0:
+                break
+            vert = nextVert
+            if degree[vert] < 2:
+                hairs.append(vert)
+                usedV[vert] = 1
+                break
+        offsets.append(len(hairs))
+
+    return np.array(hairs, dtype=np.int64), np.array(offsets, dtype=np.int64)
+
+#Seams and the vertex-edge and edge-face incidence of a mesh, from the arrays of readSheet.
+#Edges with a hidden vertex and hidden faces are left out, as if they were not there.
+#Returns a dictionary of lists:
+#edgeVerts ... the edge keys, lower vertex index first
+#seam ... True for edges marked as seams
+#vertFirst, vertEdges ... the edges of vertex v are vertEdges[vertFirst[v]:vertFirst[v + 1]]
+#edgeFirst, edgeFaces ... the faces of edge e are edgeFaces[edgeFirst[e]:edgeFirst[e + 1]]
+def getSheetArrays(mesh):
+    nVerts = len(mesh['coords'])
+    nEdges = len(mesh['edges'])
+    edges = np.sort(mesh['edges'], axis=1)
+    seam = mesh['seam']
+    hidden = mesh['hidden']
+    visible = np.flatnonzero(~(hidden[edges[:, 0]] | hidden[edges[:, 1]]))
+
+    vertFirst, order = getIncidence(edges[visible].ravel(), nVerts)
+    vertEdges = visible[order >> 1]
+
+    loopEdges = mesh['loopEdges']
+    loopStarts = mesh['loopStarts']
+    loopTotals = mesh['loopTotals']
+    faceHidden = mesh['faceHidden']
+    nFaces = len(loopTotals)
+    #the face of every loop
+    loopFaces = np.empty(len(loopEdges), dtype=np.int64)
+    faceLoops = np.arange(len(loopEdges)) + np.repeat(loopStarts - (np.cumsum(loopTotals) - loopTotals), loopTotals)
+    loopFaces[faceLoops] = np.repeat(np.arange(nFaces), loopTotals)
+    keep = ~faceHidden[loopFaces]
+    edgeFirst, order = getIncidence(loopEdges[keep], nEdges)
+    edgeFaces = loopFaces[keep][order]
+
+    return dict(edgeVerts=edges.tolist(), seam=seam.tolist(),
+                vertFirst=vertFirst.tolist(), vertEdges=vertEdges.tolist(),
+                edgeFirst=edgeFirst.tolist(), edgeFaces=edgeFaces.tolist())
 
 # returns all edge loops that a vertex is part of
-def getLoops(me, v1, vert_edges, edge_faces, seamEdges):
-    debug = False
-    
-    if not vert_edges:
-        # Create a dictionary with the vert index as key and edge-keys as value
-        #It's a list of verts and the keys are the edges the verts belong to
-        vert_edges = dict([(v.index, []) for v in me.vertices if v.hide!=1])
-        for ed in me.edges:
-            for v in ed.key:
-                if ed.key[0] in vert_edges and ed.key[1] in vert_edges:
-                    vert_edges[v].append(ed.key)
-        if debug: debPrintVertEdges(vert_edges)
-    if not edge_faces:
-        # Create a dictionary with the edge-key as key and faces as value
-        # It's a list of edges and the faces they belong to
-        edge_faces = dict([(ed.key, []) for ed in me.edges if (me.vertices[ed.vertices[0]].hide!=1 and me.vertices[ed.vertices[1]].hide!=1)])
-        for f in me.polygons:
-            for key in f.edge_keys:
-                if key in edge_faces and f.hide!=1:
-                    edge_faces[key].append(f.index)
-        if debug : debPrintEdgeFaces(edge_faces)
-    
-    ed_used = [] # starting edges that are already part of a loop that is found
+# The loops are walked over the lists of getSheetArrays. At every vertex the
+# loop continues along the edge that shares no face with the edge it came from,
+# it ends at vertices with fewer than 3 edges and at poles with more than 4.
+def getLoops(v1, sheet):
+    edgeVerts = sheet['edgeVerts']
+    vertFirst = sheet['vertFirst']
+    vertEdges = sheet['vertEdges']
+    edgeFirst = sheet['edgeFirst']
+    edgeFaces = sheet['edgeFaces']
+    v1Edges = vertEdges[vertFirst[v1]:vertFirst[v1 + 1]]
+    
+    ed_used = set() # starting edges that are already part of a loop that is found
     edgeloops = [] # to store the final results in
-    for ed in vert_edges[v1.index]: #ed is all the edges v1 is a part of
-        if ed in ed_used:
-            continue
-        seamTest = getEdgeFromKey(me, ed)
-        if seamTest.use_seam:
-            #print("Edge ", seamTest.index, " is a seam")
+    for ed in v1Edges: #ed is all the edges v1 is a part of
+        if ed in ed_used or sheet['seam'][ed]:
             continue
         
-        vloop = [] # contains all verts of the loop
+        ends = ([], []) # the verts of the loop grown from each end of ed
+        inLoop = set() # contains all verts of the loop
         poles = [] # contains the poles at the ends of the loop
         circle = False # tells if loop is circular
-        n = 0 # to differentiate between the start and the end of the loop
         
-        for m in ed: # for each vert in the edge
-            n+=1
-            active_ed = ed
-            active_v  = m
-            if active_v not in vloop:
-                vloop.insert(0,active_v)
-            else:
+        for n, m in enumerate(edgeVerts[ed]): # for each vert in the edge
+            if m in inLoop:
                 break
-            stillGrowing = True
-            while stillGrowing:
-                stillGrowing = False
-                active_f = edge_faces[active_ed] #List of faces the edge belongs to
-                new_ed = vert_edges[active_v] #list of edges the vert belongs to
-                if len(new_ed)<3: #only 1 or 2 edges
+            grown = ends[n]
+            grown.append(m)
+            inLoop.add(m)
+            active_ed = ed
+            active_v = m
+            while True:
+                new_ed = vertEdges[vertFirst[active_v]:vertFirst[active_v + 1]] #edges the vert belongs to
+                if len(new_ed) < 3: #only 1 or 2 edges
                     break
-                if len(new_ed)>4: #5-face intersection
+                if len(new_ed) > 4: #5-face intersection
                     # detect poles and stop growing
-                    if n>1:
-                        poles.insert(0,vloop.pop(0))
+                    pole = grown.pop()
+                    inLoop.discard(pole)
+                    if n > 0:
+                        poles.insert(0, pole)
                     else:
-                        poles.append(vloop.pop(-1))
+                        poles.append(pole)
                     break
+                active_f = edgeFaces[edgeFirst[active_ed]:edgeFirst[active_ed + 1]]
                 for i in new_ed: #new_ed - must have 3 or 4 edges coming from the vert
-                    eliminate = False # if edge shares face, it has to be eliminated
-                    for j in edge_faces[i]: # j is one of the face indices in edge_faces
-                        if j in active_f:
-                            eliminate = True
-                            break
-                    if not eliminate: # it's the next edge in the loop
-                        stillGrowing = True
-                        active_ed = i
-                        if active_ed in vert_edges[v1.index]: #the current edge contains v1
-                        
-                            ed_used.append(active_ed)
-                        for k in active_ed:
-                            if k != active_v:
-                                if k not in vloop:
-                                    
-                                    if n>1:
-                                        vloop.insert(0,k)
-                                    else:
-                                        vloop.append(k)
-                                    
-                                    
-                                    active_v = k
-                                    break
-                                else:
-                                    stillGrowing = False # we've come full circle
-                                    circle = True
+                    # if edge shares face, it has to be eliminated
+                    faces = edgeFaces[edgeFirst[i]:edgeFirst[i + 1]]
+                    if not any(j in active_f for j in faces):
                         break
-        #TODO: Function to sort vloop. Use v1 and edge data to walk the ring in order
-        vloop = sortLoop(vloop, v1, seamEdges, vert_edges)
+                else:
+                    break
+                # it's the next edge in the loop
+                active_ed = i
+                if active_ed in v1Edges: #the current edge contains v1
+                    ed_used.add(active_ed)
+                k = edgeVerts[i][0] if edgeVerts[i][1] == active_v else edgeVerts[i][1]
+                if k in inLoop:
+                    circle = True # we've come full circle
+                    break
+                grown.append(k)
+                inLoop.add(k)
+                active_v = k
+        
+        vloop = ends[1][::-1] + ends[0]
+        vloop = sortLoop(vloop, v1)
         edgeloops.append([vloop, poles, circle])
-    for loop in edgeloops:
-        for vert in loop[0]:
-            me.vertices[vert].select=True
-            #me.edges[edge].select=True
-    return edgeloops, vert_edges, edge_faces
-
-    
-# Hair guides. Four hair with five points each.
-def createHairGuides(obj, edgeLoops):
-    hairGuides = []
-    
-    #For each loop
-    for loop in edgeLoops:
-        thisGuide = []
-        #For each vert in the loop
-        for vert in loop[0]:
-            thisGuide.append(obj.data.vertices[vert].co)
-        hairGuides.append(thisGuide)
-    
-    return hairGuides    
+    return edgeloops
 
-def getSeams(me):
-    debug = False
-    #Make a list of all edges marked as seams
+#sheet ... the lists of getSheetArrays
+def getSeams(sheet):
     error = 0
-    seamEdges = []
-    for edge in me.edges:
-        if edge.use_seam:
-            seamEdges.append(edge)
-    #Make a list of all verts in the seam
-    seamVerts = []
-    for edge in seamEdges:
-        for vert in edge.vertices:
-            if vert not in seamVerts:
-                seamVerts.append(vert)
-                
-    if debug: debPrintSeams(seamVerts, seamEdges)
+    #Make a list of all edges marked as seams
+    seam = np.array(sheet['seam'], dtype=bool)
+    seamEdges = np.flatnonzero(seam)
+    #Make a list of all verts in the seam, in the order they are found
+    seamVerts, first = np.unique(np.array(sheet['edgeVerts'], dtype=np.int64).reshape(-1, 2)[seam],
+                                 return_index=True)
+    seamVerts = seamVerts[np.argsort(first)].tolist()
+    
+    debPrintSeams(seamVerts, seamEdges)
     
     if(len(seamEdges) == 0):
         error = 2
     
     return seamVerts, seamEdges, error
 
-def getNextVertInEdge(edge, vert):
-    if vert == edge.vertices[0]:
-        return edge.vertices[1]
-    else:
-        return edge.vertices[0]
+#For every vert in a seam, get the edge loops spawned by it.
+#mesh ... the arrays of readSheet
+#Returns the vertex indices of all hairs, one after the other, the offsets
+#where each hair starts, the error of getSeams and the pairs of hairs whose
+#roots are joined by a seam edge, neighbours along the seam.
+def getSheetHairs(mesh):
+    with timeSpan("seam scan"):
+        sheet = getSheetArrays(mesh)
+        seamVerts, seamEdges, error = getSeams(sheet)
+    hairs = []
+    offsets = [0]
+    with timeSpan("loop walk"):
+        for thisVert in seamVerts:
+            for loop in getLoops(thisVert, sheet):
+                hairs.extend(loop[0])
+                offsets.append(len(hairs))
+    hairs = np.array(hairs, dtype=np.int64)
+    offsets = np.array(offsets, dtype=np.int64)
     
+    #hair of every root vertex, the first one when a vertex spawns several
+    roots = hairs[offsets[:-1]]
+    hairOf = np.full(len(mesh['coords']), -1, dtype=np.int64)
+    hairOf[roots[::-1]] = np.arange(len(roots))[::-1]
+    pairs = hairOf[np.array(sheet['edgeVerts'], dtype=np.int64).reshape(-1, 2)[seamEdges]]
+    pairs = pairs[(pairs >= 0).all(axis=1) & (pairs[:, 0] != pairs[:, 1])]
+    return hairs, offsets, error, pairs
+
+#Guides of a hair sheet as one (n, 3) coordinate array with per guide offsets,
+#the error of getSeams and the neighbouring guide pairs along the seam.
+#Only the guide vertices are moved by trans_mat.
+#mesh ... the arrays of readSheet
+def sheetToGuides(mesh, trans_mat):
+    hairs, offsets, error, pairs = getSheetHairs(mesh)
+    return transformCoords(trans_mat, mesh['coords'][hairs]), offsets, error, pairs
+
+#Guides of a fibre mesh as one (n, 3) coordinate array with per guide offsets
+#fibers ... the arrays of readFibers
+def fibersToGuides(fibers):
+    hairs, offsets = getHairsFromFibers(fibers['edges'], len(fibers['coords']))
+    return fibers['coords'][hairs], offsets
 
-def loopsToGuides(me, edgeLoops, hairGuides):
-    guides = hairGuides
+#Points on the cubic Bezier segments between bezier points, resolution points
+#per segment and the last point, as Blender samples them when converting to a mesh
+def sampleBezier(co, handleLeft, handleRight, resolution):
+    t = (np.arange(resolution, dtype=np.float32) / resolution)[None, :, None]
+    p0 = co[:-1, None]
+    p1 = handleRight[:-1, None]
+    p2 = handleLeft[1:, None]
+    p3 = co[1:, None]
+    s = 1.0 - t
+    points = s*s*s*p0 + 3.0*s*s*t*p1 + 3.0*s*t*t*p2 + t*t*t*p3
+    return np.concatenate((points.reshape(-1, 3), co[-1:]))
+
+#Knot vector of an open NURBS spline, as Blender makes it
+def getNurbsKnots(nPoints, order, useEndpoint, useBezier):
+    count = nPoints + order
+    if useEndpoint and not useBezier:
+        return np.clip(np.arange(count) - order + 1, 0, nPoints - order + 1).astype(np.float64)
+    if useBezier and not useEndpoint:
+        if order == 4:
+            return np.floor(0.34 + np.arange(count) / 3.0)
+        if order == 3:
+            steps = ((np.arange(count) >= order) & (np.arange(count) <= nPoints)).cumsum()
+            return np.floor(0.6 + 0.5 * steps)
+    return np.arange(count, dtype=np.float64)
+
+#Points on an open NURBS spline, resolution points per control point span,
+#as Blender samples them when converting to a mesh
+#co ... (n, 4) array of control points, with the weights in the last column
+def sampleNurbs(co, order, useEndpoint, useBezier, resolution):
+    nPoints = len(co)
+    order = max(2, min(order, nPoints))
+    knots = getNurbsKnots(nPoints, order, useEndpoint, useBezier)
+    u = np.linspace(knots[order - 1], knots[nPoints], resolution * (nPoints - 1))
     
-    for loop in edgeLoops:
-        hair = [] 
-        #hair is a list of coordinate sets. guides is a list of lists
-        for vert in loop[0]:
-            
-            hair.append(me.vertices[vert].co.to_tuple())
-        guides.append(hair)
-    return guides
+    #Cox-de Boor recursion for all samples at once, the last sample belongs
+    #to the last non-empty span
+    span = np.clip(np.searchsorted(knots, u, side='right') - 1, order - 1, nPoints - 1)
+    while knots[span[-1]] == knots[span[-1] + 1] and span[-1] > order - 1:
+        span[-1] -= 1
+    basis = np.zeros((len(u), len(knots) - 1))
+    basis[np.arange(len(u)), span] = 1.0
+    for degree in range(1, order):
+        left = knots[:-degree - 1]
+        right = knots[degree + 1:]
+        denomLeft = knots[degree:-1] - left
+        denomRight = right - knots[1:-degree]
+        a = np.divide(u[:, None] - left, denomLeft, out=np.zeros((len(u), len(left))),
+                      where=denomLeft != 0)
+        b = np.divide(right - u[:, None], denomRight, out=np.zeros((len(u), len(left))),
+                      where=denomRight != 0)
+        basis = a * basis[:, :-1] + b * basis[:, 1:]
+    
+    weighted = basis * co[:, 3]
+    points = weighted.dot(co[:, :3]) / weighted.sum(axis=1)[:, None]
+    return points.astype(np.float32)
 
-def fibersToGuides(hairObj):
-    guides = []
-    hairs = getHairsFromFibers(hairObj)
-    
-    for hair in hairs:
-        guide = []
-        for vertIdx in hair:
-            guide.append(hairObj.data.vertices[vertIdx].co.to_tuple())
-        guides.append(guide)
-    return guides
-        
+#Read a vector property of spline points into an (n, 3) array
+def getSplinePoints(points, attr, size=3):
+    return readArray(points, attr, size)[:, :3]
 
-def checkGuides(hairGuides):
-    length = 0
-    for guide in hairGuides:
-        if length == 0:
-            length = len(guide)
+#Guides of a curve object, one per open spline, read from the splines without
+#converting the curve. Bezier and NURBS splines are sampled at their resolution
+#when useResolution is set, otherwise only their control points are used. Poly
+#splines use their points.
+#Returns one (n, 3) coordinate array with per guide offsets, in object space.
+def curvesToGuides(curveObj, useResolution=True):
+    guides = []
+    for spline in curveObj.data.splines:
+        #cyclic splines have no root, converted to a mesh they had no endpoint either
+        if spline.use_cyclic_u:
+            continue
+        if spline.type == 'BEZIER':
+            co = getSplinePoints(spline.bezier_points, "co")
+            if useResolution and len(co) > 1:
+                co = sampleBezier(co, getSplinePoints(spline.bezier_points, "handle_left"),
+                                  getSplinePoints(spline.bezier_points, "handle_right"),
+                                  spline.resolution_u)
+        elif spline.type == 'NURBS' and useResolution and len(spline.points) > 1:
+            co = sampleNurbs(readArray(spline.points, "co", 4).astype(np.float64), spline.order_u,
+                             spline.use_endpoint_u, spline.use_bezier_u, spline.resolution_u)
         else:
-            if length != len(guide):
-                return 1
+            co = getSplinePoints(spline.points, "co", 4)
+        if len(co) > 1:
+            guides.append(co)
+    
+    offsets = np.zeros(len(guides) + 1, dtype=np.int64)
+    np.cumsum([len(guide) for guide in guides], out=offsets[1:])
+    if not guides:
+        return np.zeros((0, 3), dtype=np.float32), offsets
+    return np.concatenate(guides), offsets
+
+#Join a list of guides into one (n, 3) coordinate array with per guide offsets
+def guidesToArrays(hairGuides):
+    offsets = np.zeros(len(hairGuides) + 1, dtype=np.int64)
+    np.cumsum([len(guide) for guide in hairGuides], out=offsets[1:])
+    coords = np.array([co for guide in hairGuides for co in guide], dtype=np.float32).reshape(-1, 3)
+    return coords, offsets
+
+#Resample every guide to nSteps points evenly spaced along its length.
+#All guides are resampled at once: the cumulative arc length runs over the
+#whole coordinate array, with the segments between guides left out, and
+#every sample is placed with one search into it. Roots and tips are kept.
+#Returns the new coordinates and offsets.
+def resampleGuides(coords, offsets, nSteps):
+    coords = np.asarray(coords, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    nGuides = len(offsets) - 1
+    if nGuides == 0:
+        return coords.astype(np.float32), offsets
+    
+    segments = np.sqrt(((coords[1:] - coords[:-1]) ** 2).sum(axis=1))
+    segments[offsets[1:-1] - 1] = 0.0
+    arc = np.zeros(len(coords))
+    np.cumsum(segments, out=arc[1:])
+    
+    start = arc[offsets[:-1]]
+    length = arc[offsets[1:] - 1] - start
+    targets = start[:, None] + length[:, None] * np.linspace(0.0, 1.0, nSteps)[None, :]
+    
+    #segment of every sample, kept inside its own guide
+    first = offsets[:-1, None]
+    last = np.maximum(offsets[1:, None] - 2, first)
+    i = np.clip(np.searchsorted(arc, targets, side='right') - 1, first, last)
+    j = np.minimum(i + 1, offsets[1:, None] - 1)
+    span = arc[j] - arc[i]
+    t = np.divide(targets - arc[i], span, out=np.zeros_like(span), where=span > 0)
+    resampled = coords[i] + t[..., None] * (coords[j] - coords[i])
+    
+    return resampled.reshape(-1, 3).astype(np.float32), np.arange(nGuides + 1, dtype=np.int64) * nSteps
+
+#Triangles of three neighbouring guides, a guide with exactly two neighbours
+#and those neighbours
+#pairs ... (n, 2) array of neighbouring guides
+def getNeighbourTriangles(pairs, nGuides):
+    ends = pairs.ravel()
+    first, order = getIncidence(ends, nGuides)
+    middle = np.flatnonzero(np.diff(first) == 2)
+    neighbours = ends[order ^ 1]
+    return np.stack((neighbours[first[middle]], middle, neighbours[first[middle] + 1]), axis=1)
+
+#Add count guides per neighbour group, blended from the guides of the group.
+#LINEAR blends the two guides of every pair at evenly spaced weights,
+#BARYCENTRIC blends the three guides of every triangle of neighbours at fixed
+#random barycentric weights. All new guides are computed with one einsum and
+#appended after the others.
+#coords, offsets ... guides with the same number of points
+#pairs ... (n, 2) array of neighbouring guides
+def interpolateGuides(coords, offsets, pairs, count, mode='LINEAR'):
+    nGuides = len(offsets) - 1
+    nSteps = int(offsets[1] - offsets[0])
+    if mode == 'LINEAR':
+        groups = pairs
+        t = np.arange(1, count + 1) / (count + 1.0)
+        weights = np.stack((1.0 - t, t), axis=1)
+    else:
+        groups = getNeighbourTriangles(pairs, nGuides)
+        weights = np.random.RandomState(0).dirichlet((1.0, 1.0, 1.0), count)
+    if not count or not len(groups):
+        return coords, offsets
+    
+    guides = coords.reshape(nGuides, nSteps, 3)
+    extra = np.einsum('kw,gwsd->gksd', weights.astype(np.float32), guides[groups])
+    coords = np.concatenate((coords, extra.reshape(-1, 3)))
+    return coords, np.arange(nGuides + len(groups) * count + 1, dtype=np.int64) * nSteps
+
+#offsets ... where each guide starts, as returned by fibersToGuides
+def checkGuides(offsets):
+    lengths = np.diff(offsets)
+    if len(lengths) and (lengths != lengths[0]).any():
+        return 1
     return 0
         
 
+#Extracted guides per hair object name, as (key, coords, offsets, error, pairs)
+_guideCache = {}
+
+#Update a hash with the values of a property of all items of a collection
+def hashCollection(digest, collection, attr, size, dtype):
+    digest.update(readArray(collection, attr, size, dtype).tobytes())
+
+#The settings of an RNA struct, such as a modifier, as a tuple.
+#Objects and other data blocks are represented by their name.
+def getSettingsKey(struct):
+    values = []
+    for prop in struct.bl_rna.properties:
+        if prop.identifier == "rna_type" or prop.type == 'COLLECTION':
+            continue
+        value = getattr(struct, prop.identifier)
+        if prop.type == 'POINTER':
+            value = getattr(value, "name", None)
+        elif getattr(prop, "is_array", False):
+            value = tuple(value)
+        values.append((prop.identifier, value))
+    return tuple(values)
+
+#Whether the evaluated mesh of an object depends on more than its own mesh
+#and modifier settings: shape keys, or modifiers using other data blocks
+#such as armatures, hooks, lattices or shrinkwrap targets.
+def usesOtherData(hairObj):
+    if hairObj.data.shape_keys is not None:
+        return True
+    for mod in hairObj.modifiers:
+        for prop in mod.bl_rna.properties:
+            if prop.type == 'POINTER' and isinstance(getattr(mod, prop.identifier), bpy.types.ID):
+                return True
+    return False
+
+#Fingerprint of everything the guides of a hair object are made from:
+#its geometry, its modifiers when they are applied, the settings used and,
+#for sheets, the transform into head space.
+#None when the guides cannot be cached, because applying the modifiers
+#reads data the fingerprint does not cover.
+def getGuideKey(hairObj, meshKind, trans_mat, apply_modifiers, use_resolution):
+    if meshKind == "SHEET" and apply_modifiers and usesOtherData(hairObj):
+        return None
+    digest = hashlib.sha1()
+    data = hairObj.data
+    if meshKind == "CURVE":
+        settings = (use_resolution, getattr(data.bevel_object, "name", None))
+        for spline in data.splines:
+            digest.update(repr((spline.type, spline.use_cyclic_u, spline.resolution_u, spline.order_u,
+                                spline.use_endpoint_u, spline.use_bezier_u)).encode())
+            hashCollection(digest, spline.bezier_points, "co", 3, np.float32)
+            hashCollection(digest, spline.bezier_points, "handle_left", 3, np.float32)
+            hashCollection(digest, spline.bezier_points, "handle_right", 3, np.float32)
+            hashCollection(digest, spline.points, "co", 4, np.float32)
+    else:
+        settings = ()
+        hashCollection(digest, data.vertices, "co", 3, np.float32)
+        hashCollection(digest, data.vertices, "hide", 1, bool)
+        hashCollection(digest, data.edges, "vertices", 2, np.int32)
+        if meshKind == "SHEET":
+            hashCollection(digest, data.edges, "use_seam", 1, bool)
+            hashCollection(digest, data.polygons, "loop_total", 1, np.int32)
+            hashCollection(digest, data.polygons, "hide", 1, bool)
+            hashCollection(digest, data.loops, "vertex_index", 1, np.int32)
+            settings = (apply_modifiers, tuple(tuple(row) for row in trans_mat))
+            if apply_modifiers:
+                settings += tuple(getSettingsKey(mod) for mod in hairObj.modifiers)
+    return (meshKind, digest.hexdigest(), settings)
+
 class HairNet (bpy.types.Operator):
     bl_idname = "particle.hairnet"
     bl_label = "HairNet"
@@ -429,139 +711,185 @@ class HairNet (bpy.types.Operator):
     apply_modifiers = BoolProperty(
         name="Apply Modifiers", default=True)
     
+    use_resolution = BoolProperty(
+        name="Curve Resolution", default=True,
+        description="Sample Bezier curves at their resolution, otherwise only use their control points")
+    
+    interpolate_guides = IntProperty(
+        name="Interpolated Guides", default=0, min=0, max=100,
+        description="Number of extra guides made between neighbouring guides along the seam of a sheet")
+    
+    interpolation = EnumProperty(
+        name="Interpolation", default='LINEAR',
+        items=[('LINEAR', "Linear", "Blend every pair of neighbouring guides"),
+               ('BARYCENTRIC', "Barycentric", "Blend every three neighbouring guides")],
+        description="How the interpolated guides are blended from their neighbours")
+    
+    guide_steps = IntProperty(
+        name="Guide Steps", default=0, min=0, max=1000,
+        description="Resample all guides by arc length to this number of points, 0 to only resample guides of different lengths to the longest one")
+    
     @classmethod
     def poll(self, context):
         return(context.mode == 'OBJECT')
     
-    
-    def execute(self, context):
-        headObj = context.object
-        
-        #Get a list of hair objects
-        hairObjList = context.selected_objects
-        hairObjList.remove(headObj)
-        hairObj = hairObjList[0]
-
-        trans_mat = headObj.matrix_world.inverted() * hairObj.matrix_world
-        
-        hairGuides = []
-        
-        error = 0   #0 = All good
-                    #1 = Hair guides have different lengths
-                    #2 = No seams in hair object
-                    
-        options = [
-                   0,                   #0 the hair system's previous settings
-                   hairObj              #1 The hair object
-                   ]
-        
-        print("******Start Here*******")
-        sysName = ''.join(["HN", hairObj.name])
-        #Get the head object. It's the last one selected
-        #headObj = bpy.context.object
-        
-        #Preserve hair settings if they exist
-        if sysName in headObj.particle_systems:
-            options[0] = headObj.particle_systems[sysName].settings
-            if sysName != headObj.particle_systems.active.name:
-                self.report(type = {'ERROR'}, message = "The selected particle system does not match the selected hair object.")
-                return{'CANCELLED'}
-        else:
-            bpy.ops.object.mode_set(mode='OBJECT')
-            #bpy.ops.object.particle_system_remove()
-            bpy.ops.object.particle_system_add()
-            headObj.particle_systems.active.name = sysName
-        
-            
-        psys = headObj.particle_systems[sysName]
-        psys.name = sysName
-        
+    #Guides of a hair object as coordinates, offsets, error and neighbour pairs.
+    def readGuides(self, context, hairObj, trans_mat):
+        #only sheets know which guides are neighbours
+        noPairs = np.zeros((0, 2), dtype=np.int64)
         if (self.meshKind=="SHEET"):
-            print("Hair sheet")
+            log.info("Hair sheet: %s", hairObj.name)
             #Create all hair guides
-            if self.apply_modifiers:
-                me = hairObj.to_mesh(context.scene, True, 'PREVIEW')
-            else:
-                me = hairObj.to_mesh(context.scene, False, 'PREVIEW')
-            for v in me.vertices:
-                v.co = trans_mat * v.co
-            #Identify the seams and their vertices
-            seamVerts, seamEdges, error = getSeams(me)
-        
-            vert_edges = edge_faces = False
-            #For every vert in a seam, get the edge loop spawned by it
-            for thisVert in seamVerts:
-                edgeLoops, vert_edges, edge_faces = getLoops(me, me.vertices[thisVert], vert_edges, edge_faces, seamEdges)
-                hairGuides = loopsToGuides(me, edgeLoops, hairGuides)
-            #debPrintHairGuides(hairGuides)
-            #Take each edge loop and extract coordinate data from its verts
-            #hairGuides = createHairGuides(hairObj, edgeLoops)
-            context.blend_data.meshes.remove(me)
+            with timeSpan("mesh eval", hairObj.name):
+                if self.apply_modifiers:
+                    me = hairObj.to_mesh(context.scene, True, 'PREVIEW')
+                else:
+                    me = hairObj.to_mesh(context.scene, False, 'PREVIEW')
+                sheet = readSheet(me)
+                context.blend_data.meshes.remove(me)
+            trans_mat = np.array(trans_mat, dtype=np.float32)
+            #Identify the seams and walk the edge loops spawned by their vertices,
+            #only the guide vertices are moved into the head object's space
+            return sheetToGuides(sheet, trans_mat)
             
         if (self.meshKind=="FIBER"):
-            print("Hair fiber")
-            #fibers = getHairsFromFibers(hairObj)
-            hairGuides = fibersToGuides(hairObj)
+            name = hairObj.name
+            log.info("Hair fiber: %s", name)
+            with timeSpan("mesh eval", name):
+                fibers = readFibers(hairObj.data)
+            with timeSpan("guide build", name):
+                return fibersToGuides(fibers) + (0, noPairs)
         
         if (self.meshKind=="CURVE"):
-            #Preserve Active and selected objects
-            tempActive = headObj = context.object
-            tempSelected = []
-            tempSelected.append(bpy.context.selected_objects[0])
-            tempSelected.append(bpy.context.selected_objects[1])
-            #hairObj = bpy.context.selected_objects[0]
-            bpy.ops.object.select_all(action='DESELECT')
-            
+            error = 0
             if hairObj.data.bevel_object != None:
                 error = 3
-                
             
-            context.scene.objects.active=hairObj
-            hairObj.select=True
+            log.info("Hair Curves: %s", hairObj.name)
+            #Read the guides straight from the splines
+            with timeSpan("guide build", hairObj.name):
+                return curvesToGuides(hairObj, self.use_resolution) + (error, noPairs)
+        
+        return guidesToArrays([]) + (0, noPairs)
+    
+    #Guides of the hair objects as coordinates, offsets, error and neighbour pairs per object name.
+    #Guides are taken from the cache when an object's geometry did not change,
+    #the others are read from Blender.
+    def getGuides(self, context, hairObjs, trans_mats):
+        guides = {}
+        for hairObj, trans_mat in zip(hairObjs, trans_mats):
+            name = hairObj.name
+            key = getGuideKey(hairObj, self.meshKind, trans_mat, self.apply_modifiers, self.use_resolution)
+            cached = _guideCache.get(name)
+            if key is not None and cached is not None and cached[0] == key:
+                log.info("Cached guides: %s", name)
+                guides[name] = cached[1:]
+                continue
+            guides[name] = self.readGuides(context, hairObj, trans_mat)
+            if key is not None:
+                _guideCache[name] = (key,) + guides[name]
+            else:
+                _guideCache.pop(name, None)
+        return guides
+    
+    
+    def execute(self, context):
+        headObj = context.object
+        
+        #Get a list of hair objects of the object type the mode reads
+        objType = 'CURVE' if self.meshKind == "CURVE" else 'MESH'
+        hairObjList = []
+        for ob in context.selected_objects:
+            if ob == headObj:
+                continue
+            if ob.type != objType:
+                self.report(type = {'WARNING'}, message = "%s: Not a %s object, skipped" % (ob.name, objType.lower()))
+                continue
+            hairObjList.append(ob)
+        if not hairObjList:
+            self.report(type = {'ERROR'}, message = "Please select the hair objects and the head object last")
+            return{'CANCELLED'}
+        
+        log.info("HairNet %s from %d objects", self.meshKind, len(hairObjList))
+        del _timings[:]
+        trans_mats = [headObj.matrix_world.inverted() * hairObj.matrix_world for hairObj in hairObjList]
+        allGuides = self.getGuides(context, hairObjList, trans_mats)
+        
+        systems = []
+        for hairObj in hairObjList:
+            guideCoords, guideOffsets, error, pairs = allGuides[hairObj.name]
+            #error: 0 = All good
+            #       1 = Hair guides have different lengths
+            #       2 = No seams in hair object
+            #       3 = Curve with a bevel object
+            
+            #Bring all guides to a common number of points
+            if not error and len(guideOffsets) > 1:
+                with timeSpan("guide build", hairObj.name):
+                    nSteps = self.guide_steps
+                    if not nSteps and checkGuides(guideOffsets):
+                        nSteps = int(np.diff(guideOffsets).max())
+                    if nSteps > 1:
+                        guideCoords, guideOffsets = resampleGuides(guideCoords, guideOffsets, nSteps)
+                    
+                    #Fill in extra guides between neighbours
+                    if self.interpolate_guides and not checkGuides(guideOffsets):
+                        guideCoords, guideOffsets = interpolateGuides(guideCoords, guideOffsets, pairs,
+                                                                      self.interpolate_guides, self.interpolation)
             
-            print("Curve Head: ", headObj.name)
-            bpy.ops.object.convert(target='MESH', keep_original=True)
-            fiberObj = context.active_object
-                        
-            print("Hair Fibers: ", fiberObj.name)
-            print("Hair Curves: ", hairObj.name)
+            if (checkGuides(guideOffsets)):
+                error = 1
             
-            hairGuides = fibersToGuides(fiberObj)
+            #Process errors, the object is left out
+            if error != 0:
+                if error == 1:
+                    message = "Mesh guides have different lengths"
+                if error == 2:
+                    message = "No seams were defined"
+                if error == 3:
+                    message = "Cannot create hair from curves with a bevel object"
+                self.report(type = {'WARNING'}, message = "%s: %s" % (hairObj.name, message))
+                continue
+            if len(guideOffsets) < 2:
+                self.report(type = {'WARNING'}, message = "%s: No hair guides found" % hairObj.name)
+                continue
             
-            bpy.ops.object.delete(use_global=False)
+            options = [
+                       0,                   #0 the hair system's previous settings
+                       hairObj              #1 The hair object
+                       ]
             
-            #Restore active object and selection
-            context.scene.objects.active=tempActive
-            bpy.ops.object.select_all(action='DESELECT')
-            for sel in tempSelected:
-                sel.select = True
-#            return {'FINISHED'}
+            #Preserve hair settings if they exist
+            sysName = ''.join(["HN", hairObj.name])
+            if sysName in headObj.particle_systems:
+                options[0] = headObj.particle_systems[sysName].settings
+            else:
+                bpy.ops.object.mode_set(mode='OBJECT')
+                bpy.ops.object.particle_system_add()
+                headObj.particle_systems.active.name = sysName
             
-        if (checkGuides(hairGuides)):
-            error = 1
+            psys = headObj.particle_systems[sysName]
+            systems.append((psys, guideCoords, guideOffsets, options))
         
-        #Process errors
-        if error != 0:
-            if error == 1:
-                self.report(type = {'ERROR'}, message = "Mesh guides have different lengths")
-            if error == 2:
-                self.report(type = {'ERROR'}, message = "No seams were defined")
-            if error == 3:
-                self.report(type = {'ERROR'}, message = "Cannot create hair from curves with a bevel object")
+        if not systems:
+            self.report(type = {'ERROR'}, message = "No hair was created")
             return{'CANCELLED'}
         
         debPrintLoc(func="Execute 2")
         
-        #Create the hair guides on the hair object
-        createHair(headObj, hairGuides, options)
+        #Create the hair guides of all hair objects on the head object
+        with timeSpan("hair write"):
+            createHair(headObj, systems)
        
         debPrintLoc(func="Execute 3")
+        for phase, seconds in sorted(getTimingTotals().items()):
+            log.info("%s: %.3f s", phase, seconds)
         return {'FINISHED'}
     
     def invoke (self, context, event):
         
-        if len(context.selected_objects) != 2:
-            self.report(type = {'ERROR'}, message = "Please select two objects")
+        if len(context.selected_objects) < 2:
+            self.report(type = {'ERROR'}, message = "Please select at least two objects")
             return {'CANCELLED'}
         
         return self.execute(context)
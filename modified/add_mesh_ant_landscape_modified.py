@@ -19,8 +19,8 @@
 bl_info = {
     "name": "ANT Landscape Modified",
     "author": "Jimmy Hazevoet",
-    "version": (0,1,2),
-    "blender": (2, 61, 0),
+    "version": (0,1,3),
+    "blender": (2, 74, 0),
     "location": "View3D > Add > Mesh",
     "description": "Add a landscape primitive",
     "warning": "", # used for warning icon and text in addons panel
@@ -40,6 +40,29 @@ Rect:            Generate rectanble or square mesh.
 Smooth:          Generate smooth shaded mesh.
 Subdivision:     Number of mesh subdivisions, higher numbers gives more detail but also slows down the script.
 Mesh size:       X,Y size of the grid mesh (in blender units).
+Update active:   Rewrite the vertices of the active landscape in place when its topology matches,
+                 instead of adding a new landscape object.
+Preview:         Generate a coarse grid for fast interactive editing.
+                 Use Refine Landscape (Object menu) or turn Preview off to get full resolution,
+                 samples already evaluated by the preview are reused.
+Preview level:   Resolution of the preview grid: 1/2, 1/4 or 1/8 of the subdivisions.
+Tiles X, Y:      Split a grid landscape into separate tile objects with identical border vertices.
+                 Every tile has its origin at its center, the noise is evaluated in landscape space.
+Adaptive:        Only refine the grid where the terrain is not flat, flat areas become large faces.
+Tolerance:       Height deviation from a plane allowed before a grid block is refined.
+LOD chunks:      Generate a quadtree of level of detail chunk objects for game engine use.
+                 Level 0 is one coarse chunk, every level splits its chunks in four at double
+                 resolution, the last level has full resolution. Chunks are parented to the chunk
+                 of the previous level they refine and carry lod_level and lod_stride properties.
+                 All levels are taken from one evaluation of the height field.
+LOD levels:      Number of quadtree levels.
+Skirt:           Depth of the skirts around every chunk, hiding the cracks between neighbouring
+                 chunks of different levels. 0 for no skirts.
+
+HEIGHTMAPS: ( File > Export / Import > Landscape Heightmap )
+Export writes the height field of a grid landscape as .npy (float32), .raw (16-bit) or .png (16-bit).
+Import memory-maps a .npy or 16-bit .raw file and builds the grid mesh from it.
+Heightmap files are laid out like images: columns along X, first row at +Y.
 
 NOISE OPTIONS: ( Most of these options are the same as in blender textures. )
 Random seed:     Use this to randomise the origin of the noise function.
@@ -73,6 +96,14 @@ Sealevel:        Flattens terrain below sealevel.
 Platlevel:       Flattens terrain above plateau level.
 Strata:          Strata amount, number of strata/terrace layers.
 Strata type:     Strata types, Smooth, Sharp-sub, Sharp-add
+
+EROSION OPTIONS: ( Grid only, applied at full resolution, previews are not eroded )
+Thermal:         Thermal erosion iterations, material slides down steep slopes.
+Talus:           Slope above which material slides.
+Hydraulic:       Hydraulic erosion iterations, rain carries material downhill.
+Rain:            Water added per iteration.
+Solubility:      Material dissolved per unit of water.
+Evaporation:     Fraction of the water evaporating per iteration.
 """
 
 # import modules
@@ -81,6 +112,11 @@ from bpy.props import *
 from mathutils import *
 from mathutils.noise import *
 from math import *
+from bpy_extras.io_utils import ExportHelper, ImportHelper
+import numpy as np
+import os
+import struct
+import zlib
 
 
 # Create a new mesh (object) from verts/edges/faces.
@@ -100,6 +136,95 @@ def create_mesh_object(context, verts, edges, faces, name):
     from bpy_extras import object_utils
     return object_utils.object_data_add(context, mesh, operator=None)
 
+# Create a new mesh from flat arrays, filled with the bulk setters
+# instead of from_pydata.
+# coords ... Vertex coordinates, flat or (n, 3).
+# loops ... Vertex index of every face corner, flat.
+# loop_totals ... Number of corners per face, or a single number
+#                 when all faces have the same size.
+# name ... Name of the new mesh.
+def create_mesh(coords, loops, loop_totals, name):
+    coords = np.ascontiguousarray(coords, dtype=np.float32).ravel()
+    loops = np.ascontiguousarray(loops, dtype=np.int32).ravel()
+    if np.ndim(loop_totals) == 0:
+        loop_totals = np.full(len(loops) // loop_totals, loop_totals, dtype=np.int32)
+    else:
+        loop_totals = np.ascontiguousarray(loop_totals, dtype=np.int32)
+    loop_starts = np.zeros(len(loop_totals), dtype=np.int32)
+    np.cumsum(loop_totals[:-1], out=loop_starts[1:])
+
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(len(coords) // 3)
+    mesh.vertices.foreach_set("co", coords)
+    mesh.loops.add(len(loops))
+    mesh.loops.foreach_set("vertex_index", loops)
+    mesh.polygons.add(len(loop_totals))
+    mesh.polygons.foreach_set("loop_start", loop_starts)
+    mesh.polygons.foreach_set("loop_total", loop_totals)
+
+    # Build the edges from the polygons.
+    mesh.update(calc_edges=True)
+    return mesh
+
+# Create a new mesh object from flat arrays, see create_mesh.
+def create_mesh_object_bulk(context, coords, loops, loop_totals, name):
+    mesh = create_mesh(coords, loops, loop_totals, name)
+
+    from bpy_extras import object_utils
+    return object_utils.object_data_add(context, mesh, operator=None)
+
+# Rewrite the vertex coordinates of an existing mesh in one bulk write.
+# mesh ... Mesh with the same vertex count and order as coords.
+# coords ... (n, 3) array of vertex coordinates.
+def update_mesh_coords(mesh, coords):
+    mesh.vertices.foreach_set("co", np.ascontiguousarray(coords, dtype=np.float32).ravel())
+    mesh.update()
+
+# Set the shading of all faces of a mesh.
+def set_smooth(mesh, smooth):
+    mesh.polygons.foreach_set("use_smooth", np.full(len(mesh.polygons), smooth, dtype=bool))
+
+# Use per vertex normals as custom split normals. This is slower than the
+# normals Blender computes from the polygons, it is only used where separate
+# objects have to shade alike across their shared borders.
+# normals ... (n, 3) array of unit vertex normals.
+def set_normals(mesh, normals):
+    mesh.use_auto_smooth = True
+    mesh.auto_smooth_angle = pi
+    mesh.normals_split_custom_set_from_vertices(normals)
+
+# Key stored on landscape meshes, identifying their topology.
+TOPOLOGY_KEY = "ant_topology"
+
+# Faces per topology, built once and reused by every redo.
+_topology_cache = {}
+
+def topology_name(topology):
+    return " ".join(str(t) for t in topology)
+
+# True if obj is a landscape mesh of the given topology and vertex count,
+# whose coordinates can be rewritten in place.
+def has_topology(obj, topology, vert_count):
+    return (obj is not None and obj.type == 'MESH'
+            and obj.data.get(TOPOLOGY_KEY) == topology_name(topology)
+            and len(obj.data.vertices) == vert_count)
+
+# Faces of a landscape topology, ('GRID', sub_d_x, sub_d_y) or ('SPHERE', sub_d).
+# Returns the flat loop indices and the loop totals as used by create_mesh.
+# cache ... Keep the faces for the next call, off for one-shot meshes
+#           such as imported heightmaps.
+def topology_faces(topology, cache=True):
+    faces = _topology_cache.get(topology)
+    if faces is None:
+        if topology[0] == 'SPHERE':
+            faces = sphere_faces(topology[1])
+        else:
+            faces = grid_faces(topology[1], topology[2]), 4
+        if cache:
+            _topology_cache.clear()
+            _topology_cache[topology] = faces
+    return faces
+
 # A very simple "bridge" tool.
 # Connects two equally long vertex rows with faces.
 # Returns a list of the new faces (list of  lists)
@@ -383,66 +508,532 @@ def landscape_gen(x,y,z,meshsize_x, meshsize_y,
     return value
 
 
-# generate grid
-def grid_gen( sub_d, size_me_x, size_me_y, options ):
+# landscape_gen over arrays of coordinates
+def heights_gen( xs, ys, zs, meshsize_x, meshsize_y, options ):
+    return np.fromiter(
+        (landscape_gen(x, y, z, meshsize_x, meshsize_y, options)
+         for x, y, z in zip(xs.tolist(), ys.tolist(), zs.tolist())),
+        dtype=np.float64, count=len(xs))
 
-    verts = []
-    faces = []
-    edgeloop_prev = []
-    
+
+# grid dimensions
+def grid_dimensions( sub_d, size_me_x, size_me_y ):
     size_me_larger = size_me_x if size_me_x >= size_me_y else size_me_y
     delta = size_me_larger / float(sub_d - 1)
     sub_d_x = round(size_me_x / delta)
     sub_d_y = round(size_me_y / delta)
+    return sub_d_x, sub_d_y, delta
+
+# grid faces, one quad per grid cell, rows along x
+def grid_faces( sub_d_x, sub_d_y ):
+    idx = np.arange(sub_d_x * sub_d_y, dtype=np.int32).reshape(sub_d_x, sub_d_y)
+    faces = np.stack((idx[:-1, :-1], idx[1:, :-1], idx[1:, 1:], idx[:-1, 1:]), axis=-1)
+    return faces.reshape(-1, 4)
+
+# Height samples of the last evaluated grid, kept between redos so that
+# coarse preview levels and the full resolution share their samples.
+_height_cache = {}
+
+def height_cache( key, shape ):
+    if _height_cache.get('key') != key:
+        _height_cache.clear()
+        _height_cache['key'] = key
+        _height_cache['z'] = np.zeros(shape, dtype=np.float32)
+        _height_cache['done'] = np.zeros(shape, dtype=bool)
+    return _height_cache
 
-    start_x = -(size_me_x / 2.0)
-    start_y = -(size_me_y / 2.0)
-
-    for row_x in range(sub_d_x):
-        edgeloop_cur = []
-        x = start_x + row_x * delta
-        for row_y in range(sub_d_y):
-            y = start_y + row_y * delta
-            z = landscape_gen(x, y, 0.0, size_me_x, size_me_y, options)
-
-            edgeloop_cur.append(len(verts))
-            verts.append((x,y,z))
+###------------------------------------------------------------
+# erosion
+# Both erosion types work on the whole height array at once, moving material
+# between every cell and its four neighbours in each iteration.
+
+# neighbour views of an edge padded array: up, down, left, right
+def neighbours( padded ):
+    return (padded[:-2, 1:-1], padded[2:, 1:-1], padded[1:-1, :-2], padded[1:-1, 2:])
+
+# move amounts out of every cell into its four neighbours
+def spread( z, amounts ):
+    up, down, left, right = amounts
+    z[:-1, :] += up[1:, :]
+    z[1:, :] += down[:-1, :]
+    z[:, :-1] += left[:, 1:]
+    z[:, 1:] += right[:, :-1]
+
+# Thermal erosion: material slides down where the height difference to a
+# neighbour is larger than talus.
+def thermal_erosion( z, iterations, talus, rate=0.5 ):
+    z = np.array(z, dtype=np.float32)
+    for i in range(iterations):
+        padded = np.pad(z, 1, mode='edge')
+        excess = [np.maximum(z - n - talus, 0.0) for n in neighbours(padded)]
+        total = excess[0] + excess[1] + excess[2] + excess[3]
+        move = np.maximum(np.maximum(excess[0], excess[1]),
+                          np.maximum(excess[2], excess[3])) * (rate * 0.5)
+        scale = np.divide(move, total, out=np.zeros_like(total), where=total > 0)
+        z -= move
+        spread(z, [e * scale for e in excess])
+    return z
+
+# Hydraulic erosion: rain dissolves material, water carries it downhill and
+# deposits it where it evaporates.
+# rain ... water added per cell and iteration.
+# solubility ... material dissolved per unit of water.
+# evaporation ... fraction of the water evaporating per iteration.
+def hydraulic_erosion( z, iterations, rain, solubility, evaporation ):
+    z = np.array(z, dtype=np.float32)
+    water = np.zeros_like(z)
+    sediment = np.zeros_like(z)
+    for i in range(iterations):
+        water += rain
+        dissolved = solubility * water
+        z -= dissolved
+        sediment += dissolved
+
+        # move water and sediment downhill, towards the lower neighbours
+        level = z + water
+        drop = [np.maximum(level - n, 0.0) for n in neighbours(np.pad(level, 1, mode='edge'))]
+        total = drop[0] + drop[1] + drop[2] + drop[3]
+        flow = np.minimum(water, total * 0.5)
+        share = np.divide(flow, total, out=np.zeros_like(total), where=total > 0)
+        carried = np.divide(sediment, water, out=np.zeros_like(water), where=water > 0)
+        water -= flow
+        sediment -= flow * carried
+        spread(water, [d * share for d in drop])
+        spread(sediment, [d * share * carried for d in drop])
+
+        # evaporate and deposit what the remaining water cannot carry
+        water *= 1.0 - evaporation
+        deposit = np.maximum(sediment - solubility * water, 0.0)
+        sediment -= deposit
+        z += deposit
+    return z + sediment
+
+# Row indices of a refinement level, every stride'th row plus the last one.
+def level_indices( count, stride ):
+    indices = np.arange(0, count, stride)
+    if indices[-1] != count - 1:
+        indices = np.append(indices, count - 1)
+    return indices
+
+# grid heights at the given rows and columns, only samples not yet in the cache are evaluated
+def grid_samples( sub_d, size_me_x, size_me_y, options, rows_x, rows_y ):
+
+    sub_d_x, sub_d_y, delta = grid_dimensions(sub_d, size_me_x, size_me_y)
+    cache = height_cache(('GRID', sub_d, size_me_x, size_me_y) + tuple(options[:EROSION]),
+                         (sub_d_x, sub_d_y))
+
+    xs = -(size_me_x / 2.0) + rows_x * delta
+    ys = -(size_me_y / 2.0) + rows_y * delta
+
+    level = np.ix_(rows_x, rows_y)
+    if erosion_options(options):
+        return xs, ys, eroded_heights(sub_d, size_me_x, size_me_y, options)[level]
+    zs = cache['z'][level]
+    todo_x, todo_y = np.nonzero(~cache['done'][level])
+    zs[todo_x, todo_y] = heights_gen(xs[todo_x], ys[todo_y], np.zeros(len(todo_x)),
+                                     size_me_x, size_me_y, options)
+    cache['z'][level] = zs
+    cache['done'][level] = True
+
+    return xs, ys, zs
+
+# The erosion settings follow the landscape_gen options in the options list.
+EROSION = 26
+
+# erosion settings of the options, None if erosion is off
+def erosion_options( options ):
+    erosion = tuple(options[EROSION:EROSION + 6])
+    if len(erosion) == 6 and (erosion[0] > 0 or erosion[2] > 0):
+        return erosion
+    return None
+
+# options for a refinement level, coarse levels are not eroded
+def level_options( options, stride ):
+    return options if stride == 1 else options[:EROSION]
+
+# Full resolution heights after erosion, computed once from the cached samples
+# and kept with them, so every tile and redo slices the same eroded field.
+def eroded_heights( sub_d, size_me_x, size_me_y, options ):
+    sub_d_x, sub_d_y, delta = grid_dimensions(sub_d, size_me_x, size_me_y)
+    erosion = erosion_options(options)
+    if _height_cache.get('erosion') != erosion:
+        xs, ys, zs = grid_samples(sub_d, size_me_x, size_me_y, options[:EROSION],
+                                  np.arange(sub_d_x), np.arange(sub_d_y))
+        thermal, talus, hydraulic, rain, solubility, evaporation = erosion
+        if thermal:
+            zs = thermal_erosion(zs, thermal, talus * delta)
+        if hydraulic:
+            zs = hydraulic_erosion(zs, hydraulic, rain, solubility, evaporation)
+        _height_cache['erosion'] = erosion
+        _height_cache['eroded'] = zs
+    return _height_cache['eroded']
+
+# rows and columns of a grid refinement level
+# tile ... First and last row and column (i0, i1, j0, j1), None for the whole grid.
+def grid_rows( sub_d, size_me_x, size_me_y, stride=1, tile=None ):
+    sub_d_x, sub_d_y, delta = grid_dimensions(sub_d, size_me_x, size_me_y)
+    i0, i1, j0, j1 = tile or (0, sub_d_x - 1, 0, sub_d_y - 1)
+    return i0 + level_indices(i1 - i0 + 1, stride), j0 + level_indices(j1 - j0 + 1, stride)
+
+# grid heights at a refinement level
+def grid_heights( sub_d, size_me_x, size_me_y, options, stride=1, tile=None ):
+    rows_x, rows_y = grid_rows(sub_d, size_me_x, size_me_y, stride, tile)
+    return grid_samples(sub_d, size_me_x, size_me_y, level_options(options, stride),
+                        rows_x, rows_y)
+
+# derivative along the first axis by finite differences, xs may be unevenly spaced
+def slopes( zs, xs ):
+    d = np.empty_like(zs)
+    d[1:-1] = (zs[2:] - zs[:-2]) / (xs[2:] - xs[:-2])[:, None]
+    d[0] = (zs[1] - zs[0]) / (xs[1] - xs[0])
+    d[-1] = (zs[-1] - zs[-2]) / (xs[-1] - xs[-2])
+    return d
+
+# Vertex normals of a grid refinement level from the height field.
+# Rows outside a tile are included in the differences so that tiles get the
+# same normals on their shared borders.
+def grid_normals( sub_d, size_me_x, size_me_y, options, stride=1, tile=None ):
+    sub_d_x, sub_d_y, delta = grid_dimensions(sub_d, size_me_x, size_me_y)
+    rows_x, rows_y = grid_rows(sub_d, size_me_x, size_me_y, stride, tile)
+
+    def extend(rows, count):
+        first = [max(rows[0] - stride, 0)] if rows[0] > 0 else []
+        last = [min(rows[-1] + stride, count - 1)] if rows[-1] < count - 1 else []
+        return np.concatenate((first, rows, last)).astype(int), len(first)
+
+    ext_x, start_x = extend(rows_x, sub_d_x)
+    ext_y, start_y = extend(rows_y, sub_d_y)
+    xs, ys, zs = grid_samples(sub_d, size_me_x, size_me_y, level_options(options, stride),
+                              ext_x, ext_y)
+
+    normals = np.empty(zs.shape + (3,))
+    normals[..., 0] = -slopes(zs, xs)
+    normals[..., 1] = -slopes(zs.T, ys).T
+    normals[..., 2] = 1.0
+    normals = normals[start_x:start_x + len(rows_x), start_y:start_y + len(rows_y)]
+    normals /= np.sqrt((normals * normals).sum(axis=-1))[..., None]
+    return normals.reshape(-1, 3)
+
+# Row ranges of tiles along one grid axis, neighbouring tiles share their border row.
+def tile_ranges( count, tiles ):
+    bounds = np.round(np.linspace(0, count - 1, tiles + 1)).astype(int).tolist()
+    return list(zip(bounds[:-1], bounds[1:]))
+
+# Tiles of a grid as (i0, i1, j0, j1) row and column ranges.
+def grid_tiles( sub_d, size_me_x, size_me_y, tiles_x, tiles_y ):
+    sub_d_x, sub_d_y, delta = grid_dimensions(sub_d, size_me_x, size_me_y)
+    tiles_x = min(tiles_x, sub_d_x - 1)
+    tiles_y = min(tiles_y, sub_d_y - 1)
+    return [(i0, i1, j0, j1)
+            for i0, i1 in tile_ranges(sub_d_x, tiles_x)
+            for j0, j1 in tile_ranges(sub_d_y, tiles_y)]
+
+# Number of quadtree levels a grid can hold, the finest level has at least
+# one grid cell per chunk.
+def lod_levels( sub_d, size_me_x, size_me_y, levels ):
+    sub_d_x, sub_d_y, delta = grid_dimensions(sub_d, size_me_x, size_me_y)
+    return max(1, min(levels, int(log2(max(1, min(sub_d_x, sub_d_y) - 1))) + 1))
+
+# Quadtree LOD chunks as (level, stride, tile, parent) with the index of the
+# parent chunk in the list, None for the root.
+# Level 0 is one chunk over the whole grid, every level splits the chunks of
+# the previous one in four and halves the stride, the last level has full
+# resolution. Tile ranges of 2**level tiles per axis nest, so every chunk
+# covers exactly one quarter of its parent.
+def lod_chunks( sub_d, size_me_x, size_me_y, levels ):
+    levels = lod_levels(sub_d, size_me_x, size_me_y, levels)
+    chunks = []
+    first = 0
+    for level in range(levels):
+        count = 2 ** level
+        stride = 2 ** (levels - 1 - level)
+        for n, tile in enumerate(grid_tiles(sub_d, size_me_x, size_me_y, count, count)):
+            parent = None
+            if level:
+                parent = first - (count // 2) ** 2 + (n // count // 2) * (count // 2) + n % count // 2
+            chunks.append((level, stride, tile, parent))
+        first = len(chunks)
+    return chunks
+
+# Border vertex indices of an (sub_d_x, sub_d_y) grid, counter clockwise seen from above.
+def grid_border( sub_d_x, sub_d_y ):
+    idx = np.arange(sub_d_x * sub_d_y).reshape(sub_d_x, sub_d_y)
+    return np.concatenate((idx[:-1, 0], idx[-1, :-1], idx[:0:-1, -1], idx[0, :0:-1]))
+
+# Skirt around a grid: the border vertices copied down by depth, and quads
+# hanging from the border edges, facing outwards. Skirts hide the cracks
+# between neighbouring chunks of different levels.
+# Returns the skirt vertices, the border indices they were copied from and
+# the skirt faces (indices after the grid vertices).
+def grid_skirt( verts, sub_d_x, sub_d_y, depth ):
+    border = grid_border(sub_d_x, sub_d_y)
+    skirt = verts[border]
+    skirt[:, 2] -= depth
+    low = len(verts) + np.arange(len(border))
+    faces = np.stack((border, low, np.roll(low, -1), np.roll(border, -1)), axis=-1)
+    return skirt, border, faces
+
+# Settings of the last preview landscape, used by landscape_refine.
+_preview_state = {}
 
-        if len(edgeloop_prev) > 0:
-            faces_row = createFaces(edgeloop_prev, edgeloop_cur)
-            faces.extend(faces_row)
+# generate grid
+def grid_gen( sub_d, size_me_x, size_me_y, options, stride=1, tile=None ):
+
+    xs, ys, zs = grid_heights(sub_d, size_me_x, size_me_y, options, stride, tile)
+
+    verts = np.empty((len(xs), len(ys), 3))
+    verts[..., 0] = xs[:, None]
+    verts[..., 1] = ys[None, :]
+    verts[..., 2] = zs
+
+    return verts.reshape(-1, 3), ('GRID', len(xs), len(ys))
+
+
+# Adaptive grid faces.
+# The grid is split into a quadtree of blocks. A block is split further while
+# its samples deviate from their least squares plane by more than tolerance.
+# Every leaf block becomes one face through all used vertices on its border,
+# so neighbouring blocks of different sizes share their edges without cracks.
+# z ... (sub_d_x, sub_d_y) heights.
+# Returns the used vertex mask and the loops and loop totals of the faces.
+def adaptive_faces( z, tolerance ):
+    sub_d_x, sub_d_y = z.shape
+    used = np.zeros(z.shape, dtype=bool)
+    leaves = []
+
+    blocks = [(0, sub_d_x - 1, 0, sub_d_y - 1)]
+    while blocks:
+        i0, i1, j0, j1 = blocks.pop()
+        split_x = i1 - i0 > 1
+        split_y = j1 - j0 > 1
+        if split_x or split_y:
+            block = z[i0:i1 + 1, j0:j1 + 1]
+            di = np.arange(i1 - i0 + 1) - (i1 - i0) / 2.0
+            dj = np.arange(j1 - j0 + 1) - (j1 - j0) / 2.0
+            centered = block - block.mean()
+            slope_i = (di[:, None] * centered).sum() / (di * di).sum() / block.shape[1]
+            slope_j = (dj[None, :] * centered).sum() / (dj * dj).sum() / block.shape[0]
+            error = np.abs(centered - slope_i * di[:, None] - slope_j * dj[None, :]).max()
+            if error > tolerance:
+                mid_i = (i0 + i1) // 2 if split_x else None
+                mid_j = (j0 + j1) // 2 if split_y else None
+                for a, b in ((i0, mid_i), (mid_i, i1)) if split_x else ((i0, i1),):
+                    for c, d in ((j0, mid_j), (mid_j, j1)) if split_y else ((j0, j1),):
+                        blocks.append((a, b, c, d))
+                continue
+        leaves.append((i0, i1, j0, j1))
+        used[i0, j0] = used[i1, j0] = used[i1, j1] = used[i0, j1] = True
+
+    index = np.cumsum(used.ravel()).reshape(z.shape) - 1
+    loops = []
+    loop_totals = []
+    for i0, i1, j0, j1 in leaves:
+        # border counter clockwise, seen from above
+        bottom = index[i0:i1, j0][used[i0:i1, j0]]
+        right = index[i1, j0:j1][used[i1, j0:j1]]
+        top = index[i1:i0:-1, j1][used[i1:i0:-1, j1]]
+        left = index[i0, j1:j0:-1][used[i0, j1:j0:-1]]
+        face = np.concatenate((bottom, right, top, left))
+        loops.append(face)
+        loop_totals.append(len(face))
+
+    return used.ravel(), np.concatenate(loops), np.array(loop_totals)
+
+
+# sphere faces
+# The sphere is welded: one vertex per pole and sub_d - 1 vertices per ring,
+# so the mesh needs no remove doubles pass and keeps a fixed vertex order.
+def sphere_faces( sub_d ):
+    ring_size = sub_d - 1
+    south = 0
+    north = 1 + (sub_d - 2) * ring_size
+
+    def ring(row_x):
+        if row_x == 0:
+            return [south] * sub_d
+        if row_x == sub_d - 1:
+            return [north] * sub_d
+        first = 1 + (row_x - 1) * ring_size
+        return list(range(first, first + ring_size)) + [first]
 
+    faces = []
+    loop_totals = []
+    edgeloop_prev = ring(0)
+    for row_x in range(1, sub_d):
+        edgeloop_cur = ring(row_x)
+        for num in range(sub_d - 1):
+            face = [edgeloop_prev[num], edgeloop_cur[num],
+                edgeloop_cur[num + 1], edgeloop_prev[num + 1]]
+            if row_x == 1:
+                del face[3]
+            elif row_x == sub_d - 1:
+                del face[2]
+            faces.extend(face)
+            loop_totals.append(len(face))
         edgeloop_prev = edgeloop_cur
 
-    return verts, faces
-
+    return np.array(faces, dtype=np.int32), np.array(loop_totals, dtype=np.int32)
 
 # generate sphere
 def sphere_gen( sub_d, size_me, options ):
 
-    verts = []
-    faces = []
-    edgeloop_prev = []
-
-    for row_x in range(sub_d):
-        edgeloop_cur = []
-        for row_y in range(sub_d):
-            u = sin(row_y*pi*2/(sub_d-1)) * cos(-pi/2+row_x*pi/(sub_d-1)) * size_me/2
-            v = cos(row_y*pi*2/(sub_d-1)) * cos(-pi/2+row_x*pi/(sub_d-1)) * size_me/2
-            w = sin(-pi/2+row_x*pi/(sub_d-1)) * size_me/2
-            h = landscape_gen(u,v,w,size_me,size_me, options) / size_me
-            u,v,w = u+u*h, v+v*h, w+w*h
-
-            edgeloop_cur.append(len(verts))
-            verts.append((u, v, w))
+    # angle tables, one entry per row and per column
+    lat = -pi/2 + np.arange(sub_d) * pi/(sub_d-1)
+    lon = np.arange(sub_d - 1) * pi*2/(sub_d-1)
+    cos_lat, sin_lat = np.cos(lat), np.sin(lat)
+    cos_lon, sin_lon = np.cos(lon), np.sin(lon)
+
+    # base directions, the poles use the first column
+    rings = np.empty((sub_d - 2, sub_d - 1, 3))
+    rings[..., 0] = sin_lon[None, :] * cos_lat[1:-1, None]
+    rings[..., 1] = cos_lon[None, :] * cos_lat[1:-1, None]
+    rings[..., 2] = sin_lat[1:-1, None]
+    south = (0.0, cos_lat[0], sin_lat[0])
+    north = (0.0, cos_lat[-1], sin_lat[-1])
+    verts = np.vstack((south, rings.reshape(-1, 3), north)) * (size_me/2)
+
+    # radial displacement
+    h = heights_gen(verts[:, 0], verts[:, 1], verts[:, 2], size_me, size_me, options) / size_me
+    verts *= (1.0 + h)[:, None]
+
+    return verts, ('SPHERE', sub_d)
+
+
+# The options list passed to landscape_gen, from the landscape_add settings.
+# settings ... landscape_add operator, or any object with the same attributes.
+def landscape_options( settings ):
+    options = [
+        settings.RandomSeed,      #0
+        settings.NoiseSize,       #1
+        settings.NoiseType,       #2
+        settings.BasisType,       #3
+        settings.VLBasisType,     #4
+        settings.Distortion,      #5
+        settings.HardNoise,       #6
+        settings.NoiseDepth,      #7
+        settings.mDimension,      #8
+        settings.mLacunarity,     #9
+        settings.mOffset,         #10
+        settings.mGain,           #11
+        settings.MarbleBias,      #12
+        settings.MarbleSharp,     #13
+        settings.MarbleShape,     #14
+        settings.Invert,          #15
+        settings.Height,          #16
+        settings.Offset,          #17
+        settings.Falloff,         #18
+        settings.FalloffSizeX,  #19
+        settings.FalloffSizeY,  #20
+        settings.Sealevel,        #21
+        settings.Plateaulevel,    #22
+        settings.Strata,          #23
+        settings.StrataType,      #24
+        settings.SphereMesh,      #25
+        settings.ThermalIterations,    #26
+        settings.Talus,                #27
+        settings.HydraulicIterations,  #28
+        settings.Rain,                 #29
+        settings.Solubility,           #30
+        settings.Evaporation           #31
+        ]
+    if settings.Falloff != '5':
+        options[19] = options[20] = settings.FalloffSize
+    return options
 
-        if len(edgeloop_prev) > 0:
-            faces_row = createFaces(edgeloop_prev, edgeloop_cur)
-            faces.extend(faces_row)
+###------------------------------------------------------------
+# heightmaps
 
-        edgeloop_prev = edgeloop_cur
+# Grid size (sub_d_x, sub_d_y) of a grid landscape object, from its
+# topology key and vertex count only, None if it is not a grid landscape.
+def landscape_shape( obj ):
+    if obj is None or obj.type != 'MESH':
+        return None
+    topology = obj.data.get(TOPOLOGY_KEY, "").split()
+    if len(topology) != 3 or topology[0] != 'GRID':
+        return None
+    shape = int(topology[1]), int(topology[2])
+    if len(obj.data.vertices) != shape[0] * shape[1]:
+        return None
+    return shape
 
-    return verts, faces
+# Heights of a grid landscape object as an (sub_d_x, sub_d_y) array,
+# None if the object is not a grid landscape.
+def landscape_heights( obj ):
+    shape = landscape_shape(obj)
+    if shape is None:
+        return None
+    coords = np.empty(len(obj.data.vertices) * 3, dtype=np.float32)
+    obj.data.vertices.foreach_get("co", coords)
+    return coords[2::3].reshape(shape)
+
+# heights scaled to the full unsigned 16-bit range, with the range used
+def heights_to_uint16( z ):
+    z_min, z_max = float(z.min()), float(z.max())
+    scale = 65535.0 / (z_max - z_min) if z_max > z_min else 0.0
+    return ((z - z_min) * scale + 0.5).astype(np.uint16), (z_min, z_max)
+
+# 16-bit grayscale png
+def write_png16( filepath, image ):
+    height, width = image.shape
+    rows = np.zeros((height, 1 + width * 2), dtype=np.uint8)
+    rows[:, 1:] = np.ascontiguousarray(image, dtype='>u2').view(np.uint8).reshape(height, width * 2)
+
+    def chunk(tag, data):
+        return (struct.pack('>I', len(data)) + tag + data
+                + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff))
+
+    with open(filepath, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 16, 0, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(rows.tobytes(), 6)))
+        f.write(chunk(b'IEND', b''))
+
+# Write a height field, z[row_x, row_y], to .npy, .raw or .png.
+# Returns the height range mapped to 0..65535 for the 16-bit formats.
+def write_heightmap( filepath, z ):
+    image = z.T[::-1]
+    ext = os.path.splitext(filepath)[1].lower()
+    if ext == '.npy':
+        np.save(filepath, np.ascontiguousarray(image, dtype=np.float32))
+        return None
+    image, z_range = heights_to_uint16(image)
+    if ext == '.png':
+        write_png16(filepath, image)
+    else:
+        image.astype('<u2').tofile(filepath)
+    return z_range
+
+# Memory-map a .npy or 16-bit .raw heightmap, returned as z[row_x, row_y].
+# width ... Row length of a .raw file, 0 for square maps.
+# Raises ValueError for files that are not a 2D height field of that size.
+def read_heightmap( filepath, width=0 ):
+    if os.path.splitext(filepath)[1].lower() == '.npy':
+        image = np.load(filepath, mmap_mode='r')
+        if image.ndim != 2:
+            raise ValueError("Heightmap must be a 2D array, got %d dimensions" % image.ndim)
+    else:
+        image = np.memmap(filepath, dtype='<u2', mode='r')
+        if not width:
+            width = int(round(sqrt(len(image))))
+            if width * width != len(image):
+                raise ValueError("%d samples are not a square map, set Raw Width" % len(image))
+        elif len(image) % width:
+            raise ValueError("%d samples do not split into rows of %d" % (len(image), width))
+        image = image.reshape(-1, width)
+    if min(image.shape) < 2:
+        raise ValueError("Heightmap needs at least 2 x 2 samples")
+    return image[::-1].T
+
+# Grid vertices for a height field, the larger side spans size.
+def heightmap_verts( z, size, height=1.0, offset=0.0 ):
+    sub_d_x, sub_d_y = z.shape
+    delta = size / float(max(sub_d_x, sub_d_y) - 1)
+    verts = np.empty((sub_d_x, sub_d_y, 3), dtype=np.float32)
+    verts[..., 0] = (np.arange(sub_d_x) - (sub_d_x - 1) / 2.0)[:, None] * delta
+    verts[..., 1] = (np.arange(sub_d_y) - (sub_d_y - 1) / 2.0)[None, :] * delta
+    np.multiply(z, height, out=verts[..., 2])
+    verts[..., 2] += offset
+    return verts.reshape(-1, 3), ('GRID', sub_d_x, sub_d_y)
 
 
 ###------------------------------------------------------------
@@ -471,6 +1062,63 @@ class landscape_add(bpy.types.Operator):
                 default=True,
                 description="Shade smooth")
 
+    UpdateActive = BoolProperty(name="Update Active",
+                default=False,
+                description="Rewrite the active landscape in place when its topology matches")
+
+    TilesX = IntProperty(name="Tiles X",
+                min=1,
+                max=64,
+                default=1,
+                description="Number of tile objects along X")
+
+    TilesY = IntProperty(name="Tiles Y",
+                min=1,
+                max=64,
+                default=1,
+                description="Number of tile objects along Y")
+
+    LodChunks = BoolProperty(name="LOD Chunks",
+                default=False,
+                description="Generate a quadtree of level of detail chunk objects")
+
+    LodLevels = IntProperty(name="LOD Levels",
+                min=1,
+                max=8,
+                default=3,
+                description="Number of quadtree levels, the last one has full resolution")
+
+    LodSkirt = FloatProperty(name="Skirt",
+                min=0.0,
+                max=1000.0,
+                default=0.05,
+                precision=3,
+                description="Depth of the skirts hiding cracks between chunks, 0 for no skirts")
+
+    AdaptiveMesh = BoolProperty(name="Adaptive",
+                default=False,
+                description="Use large faces where the terrain is flat")
+
+    AdaptiveTolerance = FloatProperty(name="Tolerance",
+                min=0.0,
+                max=100.0,
+                default=0.001,
+                precision=4,
+                description="Height deviation from a plane allowed in one face")
+
+    PreviewMesh = BoolProperty(name="Preview",
+                default=False,
+                description="Generate a coarse grid, refine it later to full resolution")
+
+    PreviewLevels = [
+                ("2","1/2","Half resolution"),
+                ("4","1/4","Quarter resolution"),
+                ("8","1/8","One eighth resolution")]
+    PreviewLevel = EnumProperty(name="Preview Level",
+                description="Resolution of the preview grid",
+                default="8",
+                items=PreviewLevels)
+
     Subdivision = IntProperty(name="Subdivisions",
                 min=4,
                 max=6400,
@@ -695,6 +1343,44 @@ class landscape_add(bpy.types.Operator):
                 default="0",
                 items=StrataTypes)
 
+    ThermalIterations = IntProperty(name="Thermal",
+                min=0,
+                max=1000,
+                default=0,
+                description="Thermal erosion iterations")
+
+    Talus = FloatProperty(name="Talus",
+                min=0.0,
+                max=10.0,
+                default=0.5,
+                description="Slope above which material slides down")
+
+    HydraulicIterations = IntProperty(name="Hydraulic",
+                min=0,
+                max=1000,
+                default=0,
+                description="Hydraulic erosion iterations")
+
+    Rain = FloatProperty(name="Rain",
+                min=0.0,
+                max=1.0,
+                default=0.01,
+                precision=4,
+                description="Water added per iteration")
+
+    Solubility = FloatProperty(name="Solubility",
+                min=0.0,
+                max=1.0,
+                default=0.01,
+                precision=4,
+                description="Material dissolved per unit of water")
+
+    Evaporation = FloatProperty(name="Evaporation",
+                min=0.0,
+                max=1.0,
+                default=0.5,
+                description="Fraction of the water evaporating per iteration")
+
     ###------------------------------------------------------------
     # Draw
     def draw(self, context):
@@ -706,6 +1392,26 @@ class landscape_add(bpy.types.Operator):
         if not self.SphereMesh:
             box.prop(self, 'RectMesh')
         box.prop(self, 'SmoothMesh')
+        box.prop(self, 'UpdateActive')
+        if not self.SphereMesh:
+            box.prop(self, 'LodChunks')
+            if self.LodChunks:
+                box.prop(self, 'LodLevels')
+                box.prop(self, 'LodSkirt')
+            else:
+                row = box.row(align=True)
+                row.prop(self, 'TilesX')
+                row.prop(self, 'TilesY')
+                # adaptive grids are single meshes at full resolution
+                adaptive = self.AdaptiveMesh and self.TilesX * self.TilesY == 1
+                if self.TilesX * self.TilesY == 1:
+                    box.prop(self, 'AdaptiveMesh')
+                    if adaptive:
+                        box.prop(self, 'AdaptiveTolerance')
+                if not adaptive:
+                    box.prop(self, 'PreviewMesh')
+                    if self.PreviewMesh:
+                        box.prop(self, 'PreviewLevel')
         box.prop(self, 'Subdivision')
         if self.SphereMesh or not self.RectMesh:
             box.prop(self, 'MeshSize')
@@ -787,6 +1493,109 @@ class landscape_add(bpy.types.Operator):
         if self.StrataType != '0':
             box.prop(self, 'Strata')
 
+        if not self.SphereMesh:
+            box = layout.box()
+            box.prop(self, 'ThermalIterations')
+            if self.ThermalIterations:
+                box.prop(self, 'Talus')
+            box.prop(self, 'HydraulicIterations')
+            if self.HydraulicIterations:
+                box.prop(self, 'Rain')
+                box.prop(self, 'Solubility')
+                box.prop(self, 'Evaporation')
+
+    ###------------------------------------------------------------
+    # Tiles
+    # Every tile evaluates its own range of the shared height cache, so the
+    # border samples two tiles share are evaluated once and match exactly.
+    def add_tiles(self, context, size_x, size_y, options, stride):
+        tiles = []
+        ranges = grid_tiles(self.Subdivision, size_x, size_y, self.TilesX, self.TilesY)
+        tiles_y = len(set(tile[2] for tile in ranges))
+        for tile in ranges:
+            verts, topology = grid_gen(self.Subdivision, size_x, size_y, options, stride, tile)
+
+            # tile origin at its center
+            center = (verts[:, :2].min(axis=0) + verts[:, :2].max(axis=0)) / 2.0
+            verts[:, :2] -= center
+
+            loops, loop_totals = topology_faces(topology)
+            name = "Landscape_%d_%d" % (len(tiles) // tiles_y, len(tiles) % tiles_y)
+            obj = create_mesh_object_bulk(context, verts, loops, loop_totals, name)
+            obj.data[TOPOLOGY_KEY] = topology_name(topology)
+            obj.location.x += center[0]
+            obj.location.y += center[1]
+            set_smooth(obj.data, self.SmoothMesh)
+            if self.SmoothMesh:
+                # height field normals, so the tiles shade alike on their shared borders
+                set_normals(obj.data, grid_normals(
+                    self.Subdivision, size_x, size_y, options, stride, tile))
+            tiles.append(obj)
+
+        for obj in tiles:
+            obj.select = True
+
+    ###------------------------------------------------------------
+    # LOD chunks
+    # The full resolution heights and normals are computed once, every chunk of
+    # every level takes its rows from them, so coarse chunks match the fine
+    # ones exactly where their vertices coincide.
+    def add_lod_chunks(self, context, size_x, size_y, options):
+        sub_d = self.Subdivision
+        sub_d_x, sub_d_y, delta = grid_dimensions(sub_d, size_x, size_y)
+        xs, ys, zs = grid_heights(sub_d, size_x, size_y, options)
+        if self.SmoothMesh:
+            normals = grid_normals(sub_d, size_x, size_y, options).reshape(sub_d_x, sub_d_y, 3)
+
+        chunks = []
+        counts = {}
+        for level, stride, tile, parent in lod_chunks(sub_d, size_x, size_y, self.LodLevels):
+            rows_x, rows_y = grid_rows(sub_d, size_x, size_y, stride, tile)
+            verts = np.empty((len(rows_x), len(rows_y), 3))
+            verts[..., 0] = xs[rows_x, None]
+            verts[..., 1] = ys[None, rows_y]
+            verts[..., 2] = zs[np.ix_(rows_x, rows_y)]
+            verts = verts.reshape(-1, 3)
+            faces = grid_faces(len(rows_x), len(rows_y))
+            if self.SmoothMesh:
+                chunk_normals = normals[np.ix_(rows_x, rows_y)].reshape(-1, 3)
+
+            if self.LodSkirt:
+                skirt, border, skirt_faces = grid_skirt(verts, len(rows_x), len(rows_y),
+                                                        self.LodSkirt)
+                verts = np.concatenate((verts, skirt))
+                faces = np.concatenate((faces, skirt_faces))
+                if self.SmoothMesh:
+                    chunk_normals = np.concatenate((chunk_normals, chunk_normals[border]))
+
+            # chunk origin at its center
+            center = (verts[:, :2].min(axis=0) + verts[:, :2].max(axis=0)) / 2.0
+            verts[:, :2] -= center
+
+            index = counts.get(level, 0)
+            counts[level] = index + 1
+            name = "Landscape_LOD%d_%d" % (level, index)
+            obj = create_mesh_object_bulk(context, verts, faces, 4, name)
+            if not self.LodSkirt:
+                obj.data[TOPOLOGY_KEY] = topology_name(('GRID', len(rows_x), len(rows_y)))
+            obj.location.x += center[0]
+            obj.location.y += center[1]
+            obj["lod_level"] = level
+            obj["lod_stride"] = stride
+            set_smooth(obj.data, self.SmoothMesh)
+            if self.SmoothMesh:
+                set_normals(obj.data, chunk_normals)
+
+            # parent to the chunk of the previous level covering it
+            if parent is not None:
+                obj.parent = chunks[parent]
+                obj.matrix_parent_inverse = Matrix.Translation(chunks[parent].location).inverted()
+            chunks.append(obj)
+
+        for obj in chunks:
+            obj.select = True
+        context.scene.objects.active = chunks[0]
+
     ###------------------------------------------------------------
     # Execute
     def execute(self, context):
@@ -803,67 +1612,81 @@ class landscape_add(bpy.types.Operator):
                 bpy.ops.object.select_all(action='DESELECT')
 
             # options
-            options = [
-                self.RandomSeed,      #0
-                self.NoiseSize,       #1
-                self.NoiseType,       #2
-                self.BasisType,       #3
-                self.VLBasisType,     #4
-                self.Distortion,      #5
-                self.HardNoise,       #6
-                self.NoiseDepth,      #7
-                self.mDimension,      #8
-                self.mLacunarity,     #9
-                self.mOffset,         #10
-                self.mGain,           #11
-                self.MarbleBias,      #12
-                self.MarbleSharp,     #13
-                self.MarbleShape,     #14
-                self.Invert,          #15
-                self.Height,          #16
-                self.Offset,          #17
-                self.Falloff,         #18
-                self.FalloffSizeX,  #19
-                self.FalloffSizeY,  #20
-                self.Sealevel,        #21
-                self.Plateaulevel,    #22
-                self.Strata,          #23
-                self.StrataType,      #24
-                self.SphereMesh       #25
-                ]
-            if self.Falloff != '5':
-                options[19] = options[20] = self.FalloffSize
+            options = landscape_options(self)
 
             # Main function
+            _preview_state.clear()
             if self.SphereMesh:
                 # sphere
-                verts, faces = sphere_gen(self.Subdivision, self.MeshSize, options)
-            elif not self.RectMesh:
-                # square grid
-                verts, faces = grid_gen(
-                    self.Subdivision, self.MeshSize, self.MeshSize, options)
+                verts, topology = sphere_gen(self.Subdivision, self.MeshSize, options)
+            else:
+                if not self.RectMesh:
+                    # square grid
+                    size_x = size_y = self.MeshSize
+                else:
+                    # rectangle grid
+                    size_x, size_y = self.MeshSizeX, self.MeshSizeY
+                if self.LodChunks:
+                    # quadtree of LOD chunks
+                    self.add_lod_chunks(context, size_x, size_y, options)
+                    bpy.context.user_preferences.edit.use_global_undo = undo
+                    return {'FINISHED'}
+                stride = int(self.PreviewLevel) if self.PreviewMesh else 1
+                if self.AdaptiveMesh and self.TilesX * self.TilesY == 1:
+                    # adaptive grids are not previewed, see draw
+                    stride = 1
+                if self.TilesX * self.TilesY > 1:
+                    # tiled grid
+                    self.add_tiles(context, size_x, size_y, options, stride)
+                    bpy.context.user_preferences.edit.use_global_undo = undo
+                    return {'FINISHED'}
+                verts, topology = grid_gen(self.Subdivision, size_x, size_y, options, stride)
+
+            obj = context.active_object
+            if self.AdaptiveMesh and not self.SphereMesh:
+                # adaptive grid, faces are wound counter clockwise already
+                z = verts[:, 2].reshape(topology[1:])
+                used, loops, loop_totals = adaptive_faces(z, self.AdaptiveTolerance)
+                obj = create_mesh_object_bulk(context, verts[used], loops, loop_totals, "Landscape")
+                set_smooth(obj.data, self.SmoothMesh)
+            elif self.SphereMesh:
+                if self.UpdateActive and has_topology(obj, topology, len(verts)):
+                    # update the active sphere in place if it has the same topology
+                    update_mesh_coords(obj.data, verts)
+                    obj.select = True
+                else:
+                    loops, loop_totals = topology_faces(topology)
+                    obj = create_mesh_object_bulk(context, verts, loops, loop_totals, "Landscape")
+                    obj.data[TOPOLOGY_KEY] = topology_name(topology)
+                    bpy.ops.object.mode_set(mode='EDIT')
+                    bpy.ops.mesh.normals_make_consistent(inside=False)
+                    bpy.ops.object.mode_set(mode='OBJECT')
+
+                # Shade smooth
+                if self.SmoothMesh !=0:
+                    if bpy.ops.object.shade_smooth.poll():
+                        bpy.ops.object.shade_smooth()
+                    else: # edit mode
+                        bpy.ops.mesh.faces_shade_smooth()
             else:
-                # rectangle grid
-                verts, faces = grid_gen(
-                    self.Subdivision, self.MeshSizeX, self.MeshSizeY, options)
-
-            # create mesh object
-            obj = create_mesh_object(context, verts, [], faces, "Landscape")
-            bpy.ops.object.mode_set(mode='EDIT')
-            bpy.ops.mesh.normals_make_consistent(inside=False)
-            bpy.ops.object.mode_set(mode='OBJECT')
-            # sphere, remove doubles
-            if self.SphereMesh !=0:
-                bpy.ops.object.mode_set(mode='EDIT')
-                bpy.ops.mesh.remove_doubles(threshold=0.0001)
-                bpy.ops.object.mode_set(mode='OBJECT')
-
-            # Shade smooth
-            if self.SmoothMesh !=0:
-                if bpy.ops.object.shade_smooth.poll():
-                    bpy.ops.object.shade_smooth()
-                else: # edit mode
-                    bpy.ops.mesh.faces_shade_smooth()
+                # update the active landscape in place if it has the same topology
+                if self.UpdateActive and has_topology(obj, topology, len(verts)):
+                    update_mesh_coords(obj.data, verts)
+                    obj.select = True
+                else:
+                    # create mesh object, grid faces are consistently wound already
+                    loops, loop_totals = topology_faces(topology)
+                    obj = create_mesh_object_bulk(context, verts, loops, loop_totals, "Landscape")
+                    obj.data[TOPOLOGY_KEY] = topology_name(topology)
+
+                # Shade smooth
+                set_smooth(obj.data, self.SmoothMesh)
+
+                # remember what the preview needs for refining
+                if stride > 1:
+                    _preview_state.update(mesh=obj.data.name, stride=stride,
+                        sub_d=self.Subdivision, size_x=size_x, size_y=size_y,
+                        options=options, smooth=self.SmoothMesh)
 
             # restore pre operator undo state
             bpy.context.user_preferences.edit.use_global_undo = undo
@@ -873,6 +1696,173 @@ class landscape_add(bpy.types.Operator):
             return {'PASS_THROUGH'}
 
 
+###------------------------------------------------------------
+# Refine preview
+class landscape_refine(bpy.types.Operator):
+    """Refine a landscape preview to full resolution, one level per timer step"""
+    bl_idname = "mesh.landscape_modified_refine"
+    bl_label = "Refine Landscape"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    _timer = None
+    _object_name = ""
+
+    @classmethod
+    def poll(cls, context):
+        obj = context.active_object
+        return (context.mode == 'OBJECT' and obj is not None and obj.type == 'MESH'
+                and obj.data.name == _preview_state.get('mesh'))
+
+    # The preview object the refine started on, None once it is gone or
+    # no longer holds the preview mesh.
+    def landscape(self):
+        obj = bpy.data.objects.get(self._object_name)
+        if (obj is None or obj.type != 'MESH' or not _preview_state
+                or obj.data.name != _preview_state.get('mesh')):
+            return None
+        return obj
+
+    def refine(self, obj):
+        state = _preview_state
+        state['stride'] //= 2
+        verts, topology = grid_gen(state['sub_d'], state['size_x'], state['size_y'],
+                                   state['options'], state['stride'])
+
+        mesh_old = obj.data
+        name = mesh_old.name
+        loops, loop_totals = topology_faces(topology)
+        mesh = create_mesh(verts, loops, loop_totals, name)
+        mesh[TOPOLOGY_KEY] = topology_name(topology)
+        set_smooth(mesh, state['smooth'])
+        obj.data = mesh
+        bpy.data.meshes.remove(mesh_old)
+        mesh.name = name
+
+        state['mesh'] = mesh.name
+        if state['stride'] <= 1:
+            state.clear()
+            return True
+        return False
+
+    def modal(self, context, event):
+        if event.type == 'ESC':
+            return self.finish(context, {'CANCELLED'})
+        if event.type == 'TIMER':
+            obj = self.landscape()
+            if obj is None:
+                self.report({'WARNING'}, "Landscape preview is gone, refine cancelled")
+                return self.finish(context, {'CANCELLED'})
+            if self.refine(obj):
+                return self.finish(context, {'FINISHED'})
+            if context.area is not None:
+                context.area.tag_redraw()
+        return {'PASS_THROUGH'}
+
+    def finish(self, context, result):
+        context.window_manager.event_timer_remove(self._timer)
+        return result
+
+    def execute(self, context):
+        self._object_name = context.active_object.name
+        while not self.refine(self.landscape()):
+            pass
+        return {'FINISHED'}
+
+    def invoke(self, context, event):
+        self._object_name = context.active_object.name
+        self._timer = context.window_manager.event_timer_add(0.1, context.window)
+        context.window_manager.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+
+###------------------------------------------------------------
+# Heightmap export / import
+class landscape_heightmap_export(bpy.types.Operator, ExportHelper):
+    """Export the height field of the active grid landscape"""
+    bl_idname = "export_mesh.landscape_heightmap"
+    bl_label = "Export Landscape Heightmap"
+
+    filename_ext = ".npy"
+    filter_glob = StringProperty(default="*.npy;*.raw;*.png", options={'HIDDEN'})
+
+    Formats = [
+                (".npy","NumPy (.npy)","32-bit float heights"),
+                (".raw","Raw (.raw)","16-bit unsigned heights, little endian"),
+                (".png","PNG (.png)","16-bit grayscale image")]
+    Format = EnumProperty(name="Format",
+                description="Heightmap file format",
+                default=".npy",
+                items=Formats)
+
+    @classmethod
+    def poll(cls, context):
+        return landscape_shape(context.active_object) is not None
+
+    def check(self, context):
+        filepath = bpy.path.ensure_ext(os.path.splitext(self.filepath)[0], self.Format)
+        if filepath != self.filepath:
+            self.filepath = filepath
+            return True
+        return False
+
+    def execute(self, context):
+        z = landscape_heights(context.active_object)
+        filepath = bpy.path.ensure_ext(os.path.splitext(self.filepath)[0], self.Format)
+        z_range = write_heightmap(filepath, z)
+        if z_range is not None:
+            self.report({'INFO'}, "Heights %.4f to %.4f mapped to 0 to 65535" % z_range)
+        return {'FINISHED'}
+
+class landscape_heightmap_import(bpy.types.Operator, ImportHelper):
+    """Build a grid landscape from a heightmap file"""
+    bl_idname = "import_mesh.landscape_heightmap"
+    bl_label = "Import Landscape Heightmap"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    filter_glob = StringProperty(default="*.npy;*.raw", options={'HIDDEN'})
+
+    MeshSize = FloatProperty(name="Mesh Size",
+                min=0.01,
+                max=100000.0,
+                default=2.0,
+                description="Size of the larger side of the grid")
+
+    Height = FloatProperty(name="Height",
+                min=0.0,
+                max=10000.0,
+                default=1.0,
+                description="Height scale, 16-bit maps are scaled from 0..1")
+
+    Offset = FloatProperty(name="Offset",
+                min=-10000.0,
+                max=10000.0,
+                default=0.0,
+                description="Height offset")
+
+    RawWidth = IntProperty(name="Raw Width",
+                min=0,
+                default=0,
+                description="Row length of .raw files, 0 for square maps")
+
+    def execute(self, context):
+        try:
+            z = read_heightmap(self.filepath, self.RawWidth)
+        except (ValueError, OSError) as error:
+            self.report({'ERROR'}, str(error))
+            return {'CANCELLED'}
+        height = self.Height
+        if z.dtype == np.uint16:
+            height /= 65535.0
+        verts, topology = heightmap_verts(z, self.MeshSize, height, self.Offset)
+        del z
+
+        loops, loop_totals = topology_faces(topology, cache=False)
+        name = os.path.splitext(os.path.basename(self.filepath))[0]
+        obj = create_mesh_object_bulk(context, verts, loops, loop_totals, name)
+        obj.data[TOPOLOGY_KEY] = topology_name(topology)
+        return {'FINISHED'}
+
+
 ###------------------------------------------------------------
 # Register
 
@@ -880,15 +1870,30 @@ class landscape_add(bpy.types.Operator):
 def menu_func_landscape(self, context):
     self.layout.operator(landscape_add.bl_idname, text="Landscape Modified", icon="PLUGIN")
 
+def menu_func_refine(self, context):
+    self.layout.operator(landscape_refine.bl_idname, text="Refine Landscape")
+
+def menu_func_heightmap_export(self, context):
+    self.layout.operator(landscape_heightmap_export.bl_idname, text="Landscape Heightmap")
+
+def menu_func_heightmap_import(self, context):
+    self.layout.operator(landscape_heightmap_import.bl_idname, text="Landscape Heightmap")
+
 def register():
     bpy.utils.register_module(__name__)
 
     bpy.types.INFO_MT_mesh_add.append(menu_func_landscape)
+    bpy.types.VIEW3D_MT_object.append(menu_func_refine)
+    bpy.types.INFO_MT_file_export.append(menu_func_heightmap_export)
+    bpy.types.INFO_MT_file_import.append(menu_func_heightmap_import)
 
 def unregister():
     bpy.utils.unregister_module(__name__)
 
     bpy.types.INFO_MT_mesh_add.remove(menu_func_landscape)
+    bpy.types.VIEW3D_MT_object.remove(menu_func_refine)
+    bpy.types.INFO_MT_file_export.remove(menu_func_heightmap_export)
+    bpy.types.INFO_MT_file_import.remove(menu_func_heightmap_import)
 
 if __name__ == "__main__":
     register()
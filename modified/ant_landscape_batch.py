@@ -0,0 +1,137 @@
+# Batch heightmap generation for ANT Landscape Modified.
+#
+# Evaluates landscape height fields for every combination of a parameter grid
+# and writes them as heightmaps with small preview images, without creating
+# any Blender meshes.
+#
+# Run from the command line with Blender in background mode:
+#   blender -b --factory-startup -P ant_landscape_batch.py -- sweep.json --out DIR [--workers 4]
+#
+# sweep.json holds landscape_add settings by property name. Settings in
+# "base" apply to every variant, every list in "sweep" is one axis of the grid:
+#   {"base": {"Subdivision": 512, "MeshSize": 2.0, "StrataType": "1"},
+#    "sweep": {"RandomSeed": [1, 2, 3], "NoiseType": ["0", "3", "9"], "Strata": [3.0, 6.0]}}
+#
+# For every variant DIR gets landscape_NNNN.npy (float32 heights),
+# landscape_NNNN.png (16-bit heights), landscape_NNNN_preview.png and
+# landscape_NNNN.json (the settings). DIR/index.json lists all variants.
+# With --workers N the variants are split over N background Blender processes.
+
+import os
+import sys
+import json
+import argparse
+import itertools
+import subprocess
+from types import SimpleNamespace
+
+import bpy
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import add_mesh_ant_landscape_modified as ant
+
+
+def script_args():
+    argv = sys.argv
+    return argv[argv.index("--") + 1:] if "--" in argv else []
+
+# landscape_add property defaults by name
+def default_settings():
+    if not hasattr(bpy.types, "MESH_OT_landscape_modified_add"):
+        ant.register()
+    properties = ant.landscape_add.bl_rna.properties
+    return dict((p.identifier, p.default) for p in properties
+                if p.identifier != "rna_type" and not getattr(p, "is_array", False))
+
+# One settings dict per combination of the sweep lists.
+def variants(sweep_file):
+    with open(sweep_file) as f:
+        grid = json.load(f)
+    base = grid.get("base", {})
+    sweep = grid.get("sweep", {})
+    names = sorted(sweep)
+    for values in itertools.product(*(sweep[name] for name in names)):
+        settings = dict(base)
+        settings.update(zip(names, values))
+        yield settings
+
+# Heights of one variant as a (sub_d_x, sub_d_y) array.
+def variant_heights(settings):
+    s = SimpleNamespace(**settings)
+    if s.RectMesh:
+        size_x, size_y = s.MeshSizeX, s.MeshSizeY
+    else:
+        size_x = size_y = s.MeshSize
+    options = ant.landscape_options(s)
+    options[25] = False
+    xs, ys, zs = ant.grid_heights(s.Subdivision, size_x, size_y, options)
+    return zs
+
+def write_variant(job, defaults, out, preview):
+    number, settings = job
+    name = os.path.join(out, "landscape_%04d" % number)
+    z = variant_heights(dict(defaults, **settings))
+
+    ant.write_heightmap(name + ".npy", z)
+    ant.write_heightmap(name + ".png", z)
+    step = max(1, max(z.shape) // preview)
+    ant.write_heightmap(name + "_preview.png", z[::step, ::step])
+    with open(name + ".json", "w") as f:
+        json.dump(settings, f, indent=1, sort_keys=True)
+    print("wrote", name)
+
+def run_jobs(jobs, out, preview):
+    defaults = default_settings()
+    for job in jobs:
+        write_variant(job, defaults, out, preview)
+
+# Split the jobs over background Blender processes.
+def run_workers(jobs, out, preview, workers):
+    processes = []
+    for n in range(workers):
+        chunk = jobs[n::workers]
+        if not chunk:
+            continue
+        job_file = os.path.join(out, "jobs_%d.json" % n)
+        with open(job_file, "w") as f:
+            json.dump(chunk, f)
+        processes.append((job_file, subprocess.Popen(
+            [bpy.app.binary_path, "-b", "--factory-startup", "-P", os.path.abspath(__file__),
+             "--", "--jobs", job_file, "--out", out, "--preview", str(preview)])))
+    failed = 0
+    for job_file, process in processes:
+        failed += process.wait() != 0
+        os.remove(job_file)
+    return failed
+
+def main():
+    parser = argparse.ArgumentParser(prog="ant_landscape_batch.py")
+    parser.add_argument("sweep", nargs="?", help="parameter grid json file")
+    parser.add_argument("--out", required=True, help="output directory")
+    parser.add_argument("--workers", type=int, default=1, help="number of Blender processes")
+    parser.add_argument("--preview", type=int, default=128, help="preview image size")
+    parser.add_argument("--jobs", help=argparse.SUPPRESS)
+    args = parser.parse_args(script_args())
+
+    # worker process
+    if args.jobs:
+        with open(args.jobs) as f:
+            run_jobs([tuple(job) for job in json.load(f)], args.out, args.preview)
+        return
+
+    if not args.sweep:
+        parser.error("a parameter grid file is required")
+    os.makedirs(args.out, exist_ok=True)
+    jobs = list(enumerate(variants(args.sweep)))
+    with open(os.path.join(args.out, "index.json"), "w") as f:
+        json.dump([dict(settings, file="landscape_%04d" % n) for n, settings in jobs],
+                  f, indent=1, sort_keys=True)
+
+    if args.workers > 1:
+        if run_workers(jobs, args.out, args.preview, args.workers):
+            sys.exit(1)
+    else:
+        run_jobs(jobs, args.out, args.preview)
+
+if __name__ == "__main__":
+    main()
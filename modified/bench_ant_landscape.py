@@ -0,0 +1,162 @@
+# Benchmarks for ANT Landscape Modified.
+#
+# Run from the command line with Blender in background mode:
+#   blender -b --factory-startup -P bench_ant_landscape.py -- mesh [--sizes 1000000 10000000]
+#   blender -b --factory-startup -P bench_ant_landscape.py -- noise [--depths 2 6] [--grids 64 128] [--out results.jsonl]
+#   blender -b --factory-startup -P bench_ant_landscape.py -- compare old.jsonl new.jsonl
+#
+# mesh ... Time mesh construction through from_pydata against the bulk
+#          create_mesh path, on square grids of the given vertex counts.
+# noise ... Sweep every noise type / basis pair over noise depths and grid
+#           sizes, reporting samples per second for the per-vertex
+#           landscape_gen loop and the batched heights_gen path.
+#           Results are appended as JSON lines to --out.
+# compare ... Print the batched throughput ratio between two result files.
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+from types import SimpleNamespace
+
+import bpy
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import add_mesh_ant_landscape_modified as ant
+from ant_landscape_batch import default_settings
+
+
+def script_args():
+    argv = sys.argv
+    return argv[argv.index("--") + 1:] if "--" in argv else []
+
+def grid_arrays(n_verts):
+    side = int(round(n_verts ** 0.5))
+    xs = np.linspace(-1.0, 1.0, side)
+    coords = np.empty((side, side, 3), dtype=np.float32)
+    coords[..., 0] = xs[:, None]
+    coords[..., 1] = xs[None, :]
+    coords[..., 2] = 0.0
+    return coords.reshape(-1, 3), ant.grid_faces(side, side)
+
+def bench_mesh(sizes):
+    print("%12s %16s %16s %8s" % ("vertices", "from_pydata (s)", "create_mesh (s)", "speedup"))
+    for n_verts in sizes:
+        coords, faces = grid_arrays(n_verts)
+
+        t = time.perf_counter()
+        mesh = bpy.data.meshes.new("bench_pydata")
+        mesh.from_pydata(coords.tolist(), [], faces.tolist())
+        mesh.update()
+        t_pydata = time.perf_counter() - t
+        bpy.data.meshes.remove(mesh)
+
+        t = time.perf_counter()
+        mesh = ant.create_mesh(coords, faces, 4, "bench_bulk")
+        t_bulk = time.perf_counter() - t
+        bpy.data.meshes.remove(mesh)
+
+        print("%12d %16.3f %16.3f %7.1fx" % (len(coords), t_pydata, t_bulk, t_pydata / t_bulk))
+
+# landscape_options of the landscape_add defaults, with the noise under test.
+def bench_options(defaults, ntype, nbasis, depth):
+    settings = dict(defaults, NoiseType=ntype, BasisType=nbasis, NoiseDepth=depth)
+    return ant.landscape_options(SimpleNamespace(**settings))
+
+def bench_noise(depths, grids, out):
+    run = {"time": time.strftime("%Y-%m-%d %H:%M:%S"),
+           "blender": bpy.app.version_string,
+           "machine": platform.platform()}
+    defaults = default_settings()
+    noise_types = [t[0] for t in ant.landscape_add.NoiseTypes]
+    basis_types = [b[0] for b in ant.landscape_add.BasisTypes]
+
+    print("%-20s %-16s %5s %5s %14s %14s" % ("type", "basis", "depth", "grid",
+                                           "per-vertex/s", "batched/s"))
+    records = []
+    for grid in grids:
+        xs, ys = np.meshgrid(np.linspace(-1.0, 1.0, grid), np.linspace(-1.0, 1.0, grid),
+                             indexing='ij')
+        xs, ys = xs.ravel(), ys.ravel()
+        zs = np.zeros(len(xs))
+        for depth in depths:
+            for ntype in noise_types:
+                for nbasis in basis_types:
+                    options = bench_options(defaults, ntype, nbasis, depth)
+
+                    t = time.perf_counter()
+                    for x, y in zip(xs.tolist(), ys.tolist()):
+                        ant.landscape_gen(x, y, 0.0, 2.0, 2.0, options)
+                    t_vertex = time.perf_counter() - t
+
+                    t = time.perf_counter()
+                    ant.heights_gen(xs, ys, zs, 2.0, 2.0, options)
+                    t_batched = time.perf_counter() - t
+
+                    record = dict(run, ntype=ntype, nbasis=nbasis, depth=depth, grid=grid,
+                                  samples=len(xs),
+                                  vertex_rate=len(xs) / t_vertex,
+                                  batched_rate=len(xs) / t_batched)
+                    records.append(record)
+                    print("%-20s %-16s %5d %5d %14.0f %14.0f" % (
+                        ant.landscape_add.NoiseTypes[int(ntype)][1],
+                        ant.landscape_add.BasisTypes[int(nbasis)][1],
+                        depth, grid, record["vertex_rate"], record["batched_rate"]))
+
+    if out:
+        with open(out, "a") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+
+def load_results(filepath):
+    results = {}
+    with open(filepath) as f:
+        for line in f:
+            if line.strip():
+                r = json.loads(line)
+                results[(r["ntype"], r["nbasis"], r["depth"], r["grid"])] = r
+    return results
+
+def compare(old, new):
+    old, new = load_results(old), load_results(new)
+    print("%-20s %-16s %5s %5s %14s %14s %7s" % ("type", "basis", "depth", "grid",
+                                                "old/s", "new/s", "ratio"))
+    for key in sorted(set(old) & set(new)):
+        ntype, nbasis, depth, grid = key
+        a, b = old[key]["batched_rate"], new[key]["batched_rate"]
+        print("%-20s %-16s %5d %5d %14.0f %14.0f %6.2fx" % (
+            ant.landscape_add.NoiseTypes[int(ntype)][1],
+            ant.landscape_add.BasisTypes[int(nbasis)][1],
+            depth, grid, a, b, b / a))
+
+def main():
+    parser = argparse.ArgumentParser(prog="bench_ant_landscape.py")
+    commands = parser.add_subparsers(dest="command")
+
+    mesh = commands.add_parser("mesh", help="mesh construction timings")
+    mesh.add_argument("--sizes", type=int, nargs="+", default=[1000000, 10000000])
+
+    noise = commands.add_parser("noise", help="noise type x basis throughput")
+    noise.add_argument("--depths", type=int, nargs="+", default=[2, 6])
+    noise.add_argument("--grids", type=int, nargs="+", default=[64, 128])
+    noise.add_argument("--out", default="")
+
+    results = commands.add_parser("compare", help="compare two noise result files")
+    results.add_argument("old")
+    results.add_argument("new")
+
+    args = parser.parse_args(script_args())
+    if args.command == "mesh":
+        bench_mesh(args.sizes)
+    elif args.command == "noise":
+        bench_noise(args.depths, args.grids, args.out)
+    elif args.command == "compare":
+        compare(args.old, args.new)
+    else:
+        parser.print_help()
+
+if __name__ == "__main__":
+    main()
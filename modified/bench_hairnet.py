@@ -0,0 +1,247 @@
+# Benchmarks for HairNet.
+#
+# Run from the command line with Blender in background mode:
+#   blender -b --factory-startup -P bench_hairnet.py -- sheet [--sizes 1000 10000 100000] [--scan-max 10000]
+#   blender -b --factory-startup -P bench_hairnet.py -- keys [--guides 1000 20000] [--steps 30]
+#
+# sheet ... Build hair sheets with about the given numbers of edges and time
+#           the guide extraction of the whole sheet from bulk seam and
+#           incidence arrays (readSheet and getSheetHairs) against the edge
+#           loop walk it replaced, which scans all edges for every edge it
+#           looks up. The scan only runs up to --scan-max edges.
+#           --sizes 1000000 gives a sheet of about 500k faces.
+# keys ... Time writing the hair keys of hair particle systems with the given
+#          numbers of guides, one key at a time through RNA against the bulk
+#          path of writeHairKeys.
+
+import os
+import sys
+import time
+import argparse
+
+import bpy
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import HairNet_modified as hn
+
+
+def script_args():
+    argv = sys.argv
+    return argv[argv.index("--") + 1:] if "--" in argv else []
+
+# Hair sheet of hairs x steps vertices, hair h runs along z from vertex
+# h * steps, the edges between the roots are marked as seams.
+def make_sheet(hairs, steps):
+    coords = []
+    for h in range(hairs):
+        for s in range(steps):
+            coords.extend((h * 0.1, 0.0, s * 0.1))
+    loops = []
+    for h in range(hairs - 1):
+        for s in range(steps - 1):
+            a = h * steps + s
+            loops.extend((a, a + steps, a + steps + 1, a + 1))
+
+    mesh = bpy.data.meshes.new("bench_sheet")
+    mesh.vertices.add(hairs * steps)
+    mesh.vertices.foreach_set("co", coords)
+    mesh.loops.add(len(loops))
+    mesh.loops.foreach_set("vertex_index", loops)
+    mesh.polygons.add(len(loops) // 4)
+    mesh.polygons.foreach_set("loop_start", range(0, len(loops), 4))
+    mesh.polygons.foreach_set("loop_total", [4] * (len(loops) // 4))
+    mesh.update(calc_edges=True)
+
+    edge_verts = [0] * (len(mesh.edges) * 2)
+    mesh.edges.foreach_get("vertices", edge_verts)
+    mesh.edges.foreach_set("use_seam", [
+        edge_verts[i] % steps == 0 and edge_verts[i + 1] % steps == 0
+        for i in range(0, len(edge_verts), 2)])
+    return mesh
+
+# The edge lookup of getLoops before the bulk arrays, a scan of all edges.
+def scan_edge(mesh, key):
+    v1 = key[0]
+    v2 = key[1]
+    for edge in mesh.edges:
+        if v1 in edge.vertices and v2 in edge.vertices:
+            return edge
+    return 0
+
+# The edge loops through vertex v1 as getLoops walked them before the bulk
+# arrays, seam edges are looked up with scan_edge.
+def scan_loops(me, v1, vert_edges, edge_faces):
+    ed_used = []
+    edgeloops = []
+    for ed in vert_edges[v1]:
+        if ed in ed_used:
+            continue
+        if scan_edge(me, ed).use_seam:
+            continue
+
+        vloop = []
+        n = 0
+        for m in ed:
+            n+=1
+            active_ed = ed
+            active_v  = m
+            if active_v not in vloop:
+                vloop.insert(0,active_v)
+            else:
+                break
+            stillGrowing = True
+            while stillGrowing:
+                stillGrowing = False
+                active_f = edge_faces[active_ed]
+                new_ed = vert_edges[active_v]
+                if len(new_ed)<3 or len(new_ed)>4:
+                    break
+                for i in new_ed:
+                    eliminate = False
+                    for j in edge_faces[i]:
+                        if j in active_f:
+                            eliminate = True
+                            break
+                    if not eliminate:
+                        stillGrowing = True
+                        active_ed = i
+                        if active_ed in vert_edges[v1]:
+                            ed_used.append(active_ed)
+                        for k in active_ed:
+                            if k != active_v:
+                                if k not in vloop:
+                                    if n>1:
+                                        vloop.insert(0,k)
+                                    else:
+                                        vloop.append(k)
+                                    active_v = k
+                                    break
+                                else:
+                                    stillGrowing = False
+                        break
+        edgeloops.append(vloop if vloop[0] == v1 else vloop[::-1])
+    return edgeloops
+
+# Guides of a sheet as getSeams, getLoops and loopsToGuides made them before
+# the bulk arrays.
+def scan_sheet(me):
+    vert_edges = dict([(v.index, []) for v in me.vertices if v.hide!=1])
+    for ed in me.edges:
+        for v in ed.key:
+            if ed.key[0] in vert_edges and ed.key[1] in vert_edges:
+                vert_edges[v].append(ed.key)
+    edge_faces = dict([(ed.key, []) for ed in me.edges])
+    for f in me.polygons:
+        for key in f.edge_keys:
+            if key in edge_faces and f.hide!=1:
+                edge_faces[key].append(f.index)
+
+    seamVerts = []
+    for edge in me.edges:
+        if edge.use_seam:
+            for vert in edge.vertices:
+                if vert not in seamVerts:
+                    seamVerts.append(vert)
+
+    guides = []
+    for v1 in seamVerts:
+        for loop in scan_loops(me, v1, vert_edges, edge_faces):
+            guides.append([me.vertices[vert].co.to_tuple() for vert in loop])
+    return guides
+
+def bench_sheet(sizes, scan_max, steps=20):
+    print("%10s %8s %8s %10s %12s %10s %8s" % ("edges", "faces", "guides", "read (s)",
+                                              "extract (s)", "scan (s)", "speedup"))
+    for n_edges in sizes:
+        mesh = make_sheet(max(2, n_edges // (2 * steps)), steps)
+
+        t = time.perf_counter()
+        sheet = hn.readSheet(mesh)
+        t_read = time.perf_counter() - t
+
+        t = time.perf_counter()
+        hairs, offsets, error, pairs = hn.getSheetHairs(sheet)
+        t_extract = time.perf_counter() - t
+
+        scan = "%10s %8s" % ("-", "-")
+        if len(mesh.edges) <= scan_max:
+            t = time.perf_counter()
+            guides = scan_sheet(mesh)
+            t_scan = time.perf_counter() - t
+            assert len(guides) == len(offsets) - 1
+            scan = "%10.3f %7.1fx" % (t_scan, t_scan / (t_read + t_extract))
+
+        print("%10d %8d %8d %10.3f %12.3f %s" % (
+            len(mesh.edges), len(mesh.polygons), len(offsets) - 1, t_read, t_extract, scan))
+        bpy.data.meshes.remove(mesh)
+
+# Hair particle system on a plane, with guides x steps hair keys.
+def make_groom(guides, steps):
+    bpy.ops.mesh.primitive_plane_add()
+    ob = bpy.context.object
+    ob.modifiers.new("bench_hair", 'PARTICLE_SYSTEM')
+    pset = ob.particle_systems[0].settings
+    pset.type = 'HAIR'
+    pset.hair_step = steps - 1
+    pset.count = guides
+    bpy.context.scene.update()
+    return ob
+
+# The hair key writing of createHair before the bulk path.
+def write_keys_single(psys, coords, nSteps):
+    dt = 100.0/(nSteps-1)
+    dw = 1.0/(nSteps-1)
+    guides = coords.reshape(-1, nSteps, 3).tolist()
+    for m, guide in enumerate(guides):
+        part = psys.particles[m]
+        part.location = guide[0]
+        for n in range(nSteps):
+            h = part.hair_keys[n]
+            h.co = guide[n]
+            h.time = n*dt
+            h.weight = 1.0 - n*dw
+
+def bench_keys(guide_counts, steps):
+    print("%8s %6s %10s %14s %12s %8s" % ("guides", "steps", "keys", "per-key (s)",
+                                         "bulk (s)", "speedup"))
+    for guides in guide_counts:
+        ob = make_groom(guides, steps)
+        psys = ob.particle_systems[0]
+        coords = np.random.random((guides * steps, 3)).astype(np.float32)
+
+        t = time.perf_counter()
+        write_keys_single(psys, coords, steps)
+        t_single = time.perf_counter() - t
+
+        t = time.perf_counter()
+        bulk = hn.writeHairKeys(psys, coords, steps)
+        t_bulk = time.perf_counter() - t
+
+        print("%8d %6d %10d %14.3f %12.3f %7.1fx%s" % (
+            guides, steps, guides * steps, t_single, t_bulk, t_single / t_bulk,
+            "" if bulk else " (fallback)"))
+        bpy.data.objects.remove(ob, do_unlink=True)
+
+def main():
+    parser = argparse.ArgumentParser(prog="bench_hairnet.py")
+    commands = parser.add_subparsers(dest="command")
+
+    sheet = commands.add_parser("sheet", help="sheet guide extraction timings")
+    sheet.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    sheet.add_argument("--scan-max", type=int, default=10000)
+
+    keys = commands.add_parser("keys", help="hair key writing timings")
+    keys.add_argument("--guides", type=int, nargs="+", default=[1000, 20000])
+    keys.add_argument("--steps", type=int, default=30)
+
+    args = parser.parse_args(script_args())
+    if args.command == "sheet":
+        bench_sheet(args.sizes, args.scan_max)
+    elif args.command == "keys":
+        bench_keys(args.guides, args.steps)
+    else:
+        parser.print_help()
+
+if __name__ == "__main__":
+    main()